@@ -0,0 +1,486 @@
+"""
+Factor class holds variables, cardinality, stride values, and phi table for a factor.
+
+The phi table is a contiguous numpy array laid out with the last variable changing fastest,
+so the stride of a variable is the product of the cardinalities of the variables after it.
+Factor operations are vectorized over the whole table instead of looping over assignments.
+A list of factors can also be multiplied and summed out in one contraction, pairing factors
+so that the full product of the list is never materialized.
+
+Each factor also carries a log scale, so the values it represents are phi * exp(logScale).
+Rescaling a factor moves its largest entry into the log scale, which keeps long chains of
+products and sums within floating point range on large networks.
+
+New tables larger than a scratch threshold can be stored as memory-mapped files on scratch
+disk instead of in memory. They are filled one block at a time by fixing their slowest
+variables, so no more than about half the threshold is computed in memory at once. Those
+variables are also the slowest ones of the largest input where possible, but smaller inputs
+laid out differently are read strided from disk once per block.
+
+Author: Jordan Weiler
+Date:   October 18, 2026
+"""
+
+import numpy as np
+import math, os, tempfile, heapq
+
+# New tables over this many bytes are memory-mapped from files in scratchDir
+scratchThreshold = None
+scratchDir = None
+
+class Factor:
+    def __init__(self, variables, cardValues, phi=None):
+        self.variables = list(variables)
+        self.card = []
+        self.stride = []
+        self.size = 1
+        self.logScale = 0.0
+        self.setCards(cardValues)
+        self.calculateStrides()
+        self.phi = None
+        if phi is not None:
+            self.setPhi(phi)
+
+    def calculateStrides(self):
+        """
+        Calculate the strides for each of the variables and the total size of the factor
+        """
+        total = 1
+        for i in range(len(self.card)-1, -1, -1):
+            self.stride[i] = total
+            total *= self.card[i]
+        self.size = total
+
+    def printF(self):
+        """
+        Print the factor details
+        """
+        print "Factor"
+        print "var:", self.variables
+        print "card:", self.card
+        print "stride:", self.stride
+        print "size:", self.size
+        print "phi:", self.phi
+        print "log scale:", self.logScale
+        print ""
+
+    def logTotal(self):
+        """
+        Log of the sum of all values represented by the factor
+        """
+        tot = self.phi.sum()
+        if tot <= 0:
+            return float("-inf")
+        return math.log(tot) + self.logScale
+
+    def renormalize(self):
+        """
+        Renormalize the phi values to add up to 1.0
+        """
+        tot = self.phi.sum()
+        if tot == 0:
+            self.phi = np.empty(self.size)
+            self.phi.fill(1.0 / self.size)
+        else:
+            self.phi = self.phi / tot
+        self.logScale = 0.0
+
+    def rescale(self):
+        """
+        Divide the phi values by their maximum and add its log to the log scale
+        """
+        m = self.phi.max()
+        if m > 0 and m != 1:
+            if isinstance(self.phi, np.memmap):
+                # Scratch tables are divided in place so they never come back into memory
+                self.phi /= m
+            else:
+                self.phi = self.phi / m
+            self.logScale += math.log(m)
+
+    def setCard(self, cardValue):
+        """
+        Set the cardinality for a variable
+        """
+        self.card.append(cardValue)
+        self.stride.append(0)
+
+    def setCards(self, cardValues):
+        """
+        Sets the cardinality for each of the variables
+        """
+        for i in range(len(self.variables)):
+            self.setCard(cardValues[self.variables[i]])
+
+    def setPhi(self, phi):
+        """
+        Set the phi table, checking it matches the size of the factor
+        """
+        phi = np.ascontiguousarray(phi, dtype=np.float64).ravel()
+        if len(phi) != self.size:
+            raise Exception("Error: factor over " + str(self.variables) + " needs " + str(self.size) + " values but got " + str(len(phi)))
+        self.phi = phi
+
+    def table(self):
+        """
+        Return the phi table as a multi-dimensional array with one axis per variable
+        """
+        return self.phi.reshape(self.shape())
+
+    def shape(self):
+        """
+        Return the shape of the phi table with one axis per variable
+        """
+        return tuple(self.card)
+
+def cardsOf(*factors):
+    """
+    Build a variable to cardinality map from the given factors
+    """
+    cards = dict()
+    for f in factors:
+        for i in range(len(f.variables)):
+            cards[f.variables[i]] = f.card[i]
+    return cards
+
+def expandTable(factor, variables, cards):
+    """
+    View the phi table of a factor so it broadcasts against a table over the given variables
+    """
+    if len(factor.variables) == 0:
+        return factor.phi.reshape((1,) * len(variables))
+
+    # Move the factor's axes into the order they appear in variables
+    order = sorted(range(len(factor.variables)), key=lambda i: variables.index(factor.variables[i]))
+    table = factor.table().transpose(order)
+
+    # Insert unit axes for variables the factor does not depend on
+    shape = [cards[v] if v in factor.variables else 1 for v in variables]
+    return table.reshape(shape)
+
+def factorProduct(f1, f2):
+    """
+    Multiplies two factors by broadcasting matching variable assignments together
+    """
+    # Get the unique variables across both factors
+    uniqueVars = [v for v in f1.variables if v not in f2.variables] + f2.variables
+    cards = cardsOf(f1, f2)
+
+    factor = Factor(uniqueVars, cards)
+    psi = expandTable(f1, uniqueVars, cards) * expandTable(f2, uniqueVars, cards)
+    factor.phi = np.ascontiguousarray(psi).ravel()
+    factor.logScale = f1.logScale + f2.logScale
+
+    return factor
+
+def contractFactors(factors, variables, rescale=False):
+    """
+    Multiply a list of factors and sum out variables without materializing the full product
+    """
+    steps = contractionOrder([f.variables for f in factors], cardsOf(*factors), variables)
+
+    factors = list(factors)
+    for a, b, keep in steps:
+        factors.append(contractPair(factors[a], factors[b], keep))
+        if rescale:
+            factors[-1].rescale()
+        # Drop references to the inputs so their tables can be freed
+        factors[a], factors[b] = None, None
+
+    result = factors[-1]
+    remaining = [v for v in result.variables if v in variables]
+    if len(remaining) > 0:
+        result = sumOutVariables(result, remaining)
+    elif len(steps) == 0 and rescale:
+        # Rescale a copy rather than the caller's factor
+        return rescaled(result)
+    if rescale:
+        result.rescale()
+    return result
+
+def contractionOrder(scopes, cards, variables):
+    """
+    Greedily choose the order of pairwise products that keeps each intermediate table smallest
+
+    Returns a list of (a, b, keep) steps. Step k multiplies tables a and b, sums out every
+    variable not in keep and appends the result as table len(scopes) + k.
+
+    Only tables sharing a variable are paired, and pair costs stay in a heap between steps.
+    Once every live table fits inside the largest one the rest are multiplied straight into it.
+    """
+    scopes = [list(s) for s in scopes]
+    sizes = [tableSize(cards, s) for s in scopes]
+    variables = set(variables)
+    alive = set(range(len(scopes)))
+    version = [0] * len(scopes)
+
+    # Live tables holding each variable, dropping variables once no table holds them
+    holders = dict()
+    for i in range(len(scopes)):
+        for v in scopes[i]:
+            holders.setdefault(v, set()).add(i)
+
+    def pairEntry(a, b):
+        a, b = min(a, b), max(a, b)
+        union = scopes[a] + [v for v in scopes[b] if v not in scopes[a]]
+        # A variable can be summed out once no other table depends on it
+        keep = [v for v in union if v not in variables or len(holders[v]) > (v in scopes[a]) + (v in scopes[b])]
+        return ((tableSize(cards, keep), tableSize(cards, union)), a, b, version[a], version[b], keep)
+
+    def pushPairs(a):
+        # Bumping the version of a invalidates every pair it was in
+        version[a] += 1
+        partners = set()
+        for v in scopes[a]:
+            partners.update(holders[v])
+        partners.discard(a)
+        for b in partners:
+            heapq.heappush(heap, pairEntry(a, b))
+
+    heap = []
+    for a in range(len(scopes)):
+        partners = set()
+        for v in scopes[a]:
+            partners.update(holders[v])
+        for b in partners:
+            if b > a:
+                heap.append(pairEntry(a, b))
+    heapq.heapify(heap)
+
+    steps = []
+    while len(alive) > 1:
+        largest = max(alive, key=lambda i: (sizes[i], -i))
+        if len(holders) == len(scopes[largest]):
+            # Larger tables go first so variables are summed out while the rest are multiplied in
+            for b in sorted(alive - set([largest]), key=lambda i: (-sizes[i], i)):
+                # Sum out variables as soon as the last other table holding them is multiplied in
+                for v in scopes[b]:
+                    holders[v].discard(b)
+                keep = [v for v in scopes[largest] if v not in variables or len(holders[v]) > 1]
+                steps.append((largest, b, keep))
+                scopes.append(keep)
+                for v in keep:
+                    holders[v].discard(largest)
+                    holders[v].add(len(scopes) - 1)
+                largest = len(scopes) - 1
+            return steps
+
+        entry = None
+        while len(heap) > 0 and entry is None:
+            cost, a, b, va, vb, keep = heapq.heappop(heap)
+            if a in alive and b in alive and version[a] == va and version[b] == vb:
+                entry = (a, b, keep)
+        if entry is None:
+            # No live tables share a variable, so take the outer product of the two smallest
+            a, b = sorted(alive, key=lambda i: (sizes[i], i))[:2]
+            cost, a, b, va, vb, keep = pairEntry(a, b)
+            entry = (a, b, keep)
+        a, b, keep = entry
+
+        steps.append((a, b, keep))
+        c = len(scopes)
+        scopes.append(keep)
+        sizes.append(tableSize(cards, keep))
+        version.append(0)
+        alive.difference_update([a, b])
+        alive.add(c)
+
+        changed = []
+        for v in set(scopes[a] + scopes[b]):
+            holders[v].difference_update([a, b])
+            if v in keep:
+                holders[v].add(c)
+                # Whether v can be summed out only changes for pairs once two tables are left
+                if v in scopes[a] and v in scopes[b] and len(holders[v]) <= 2:
+                    changed.append(v)
+            elif len(holders[v]) == 0:
+                del holders[v]
+
+        stale = set()
+        for v in changed:
+            stale.update(holders[v])
+        stale.discard(c)
+        for t in sorted(stale):
+            pushPairs(t)
+        pushPairs(c)
+
+    return steps
+
+def contractPair(f1, f2, keep):
+    """
+    Multiply two factors and sum out every variable not in keep in a single einsum
+    """
+    cards = cardsOf(f1, f2)
+    labels = dict()
+    for v in f1.variables + f2.variables:
+        if v not in labels:
+            labels[v] = len(labels)
+
+    def compute(fixed, order):
+        t1, vars1 = fixedTable(f1, fixed)
+        t2, vars2 = fixedTable(f2, fixed)
+        return np.einsum(t1, [labels[v] for v in vars1], t2, [labels[v] for v in vars2],
+                         [labels[v] for v in order])
+
+    order, table = fillBlocks(keep, cards, compute, [f1, f2])
+    factor = Factor(order, cards)
+    factor.phi = table.ravel()
+    factor.logScale = f1.logScale + f2.logScale
+    return factor
+
+def fillBlocks(variables, cards, compute, inputs):
+    """
+    Build the table of a new factor over variables from its input factors, returning the
+    order of its variables and the table
+
+    compute(fixed, order) returns the part of the table where the variables in fixed take the
+    given values, with one axis for each variable in order. Tables over the scratch threshold
+    are built block by block along their slowest variables. Their variables are put in the
+    order they have in the largest input first, so a block also reads the fewest separate
+    runs of that input. The smaller inputs are read strided wherever their slow variables
+    differ, once for every block.
+    """
+    if scratchThreshold is None or tableSize(cards, variables) * 8 <= scratchThreshold:
+        return variables, np.ascontiguousarray(compute(dict(), variables))
+
+    largest = max(inputs, key=lambda f: f.size)
+    front = [v for v in largest.variables if v in variables]
+    variables = front + [v for v in variables if v not in front]
+
+    # Fix just enough of the slowest variables that every block is within half the threshold
+    shape = tuple(cards[v] for v in variables)
+    table = scratchTable(shape)
+    lead, block = 0, table.size
+    while lead < len(variables) and block * 8 > scratchThreshold // 2:
+        block //= shape[lead]
+        lead += 1
+    for index in np.ndindex(*shape[:lead]):
+        table[index] = compute(dict(zip(variables[:lead], index)), variables[lead:])
+    return variables, table
+
+def fixedTable(factor, fixed):
+    """
+    View the table of a factor with the variables in fixed set to their values, returning the
+    view and the variables of its remaining axes
+    """
+    index = tuple(fixed.get(v, slice(None)) for v in factor.variables)
+    return factor.table()[index], [v for v in factor.variables if v not in fixed]
+
+def factorProductList(factors):
+    """
+    Find the product of a list of factors
+    """
+    newF = factors[0]
+    for i in range(1, len(factors)):
+        newF = factorProduct(newF, factors[i])
+    return newF
+
+def reduceFactor(factor, evidence):
+    """
+    Slice a factor to the observed values in evidence (a variable to value map)
+    """
+    index = []
+    newVars = []
+    for v in factor.variables:
+        if v in evidence:
+            index.append(evidence[v])
+        else:
+            index.append(slice(None))
+            newVars.append(v)
+
+    if len(newVars) == len(factor.variables):
+        return factor
+
+    cards = cardsOf(factor)
+    newF = Factor(newVars, cards)
+    newF.phi = np.ascontiguousarray(factor.table()[tuple(index)]).ravel()
+    newF.logScale = factor.logScale
+    return newF
+
+def reduceFactors(factors, evidence):
+    """
+    Slice every factor to the observed values, dropping observed variables from their scopes
+    """
+    if len(evidence) == 0:
+        return list(factors)
+    return [reduceFactor(f, evidence) for f in factors]
+
+def rescaled(factor):
+    """
+    Return a rescaled copy of a factor, leaving the original untouched
+    """
+    phi = factor.phi
+    if isinstance(phi, np.memmap):
+        # A scratch table is rescaled in place, so copy it first
+        phi = scratchTable(phi.shape)
+        phi[:] = factor.phi
+    # Set phi directly, since setPhi would load a scratch table into memory
+    newF = Factor(factor.variables, cardsOf(factor))
+    newF.phi = phi
+    newF.logScale = factor.logScale
+    newF.rescale()
+    return newF
+
+def scratchTable(shape):
+    """
+    Allocate an uninitialized table in a memory-mapped file on scratch disk
+    """
+    fd, name = tempfile.mkstemp(suffix=".phi", dir=scratchDir)
+    os.close(fd)
+    try:
+        return np.memmap(name, dtype=np.float64, mode="w+", shape=shape)
+    finally:
+        # The mapping keeps the file's data alive, and its space is freed along with the table
+        os.unlink(name)
+
+def useScratch(threshold, directory=None):
+    """
+    Store new tables over threshold bytes in memory-mapped files under directory, or in the
+    default temporary directory
+    """
+    global scratchThreshold, scratchDir
+    scratchThreshold, scratchDir = threshold, directory
+
+def sumOutVariables(factor, variables):
+    """
+    Sum out a list of variables from a factor
+    """
+    return eliminateVariables(factor, variables, np.sum)
+
+def maxOutVariables(factor, variables):
+    """
+    Maximize a list of variables out of a factor
+    """
+    return eliminateVariables(factor, variables, np.max)
+
+def minOutVariables(factor, variables):
+    """
+    Minimize a list of variables out of a factor
+    """
+    return eliminateVariables(factor, variables, np.min)
+
+def eliminateVariables(factor, variables, reduce):
+    """
+    Remove a list of variables from a factor by reducing its table along their axes
+    """
+    newVars = [v for v in factor.variables if v not in variables]
+
+    # The remaining variables keep the factor's order, which is the order fillBlocks asks for
+    def compute(fixed, order):
+        table, remaining = fixedTable(factor, fixed)
+        return reduce(table, axis=tuple(i for i in range(len(remaining)) if remaining[i] in variables))
+
+    order, table = fillBlocks(newVars, cardsOf(factor), compute, [factor])
+    newF = Factor(order, cardsOf(factor))
+    newF.phi = table.ravel()
+    newF.logScale = factor.logScale
+    return newF
+
+def tableSize(cards, scope):
+    """
+    Number of entries in a table over the given variables
+    """
+    size = 1
+    for v in scope:
+        size *= cards[v]
+    return size
@@ -0,0 +1,157 @@
+"""
+Interaction graph of a Markov network and greedy elimination ordering heuristics.
+
+Two variables are neighbors in the interaction graph when they appear in a clique together.
+An elimination ordering is built greedily by repeatedly eliminating the variable with the
+lowest heuristic score and connecting its remaining neighbors. Ties are broken at random so
+several restarts can be tried and the best ordering kept.
+
+Author: Jordan Weiler
+Date:   October 18, 2026
+"""
+
+import random
+
+HEURISTICS = ["minneighbors", "minweight", "minfill", "weightedminfill"]
+
+def interactionGraph(nVars, cliques):
+    """
+    Build the neighbor set of every variable from the cliques
+    """
+    graph = [set() for i in range(nVars)]
+    for clique in cliques:
+        for v in clique:
+            graph[v].update(clique)
+    for v in range(nVars):
+        graph[v].discard(v)
+    return graph
+
+def eliminationScore(graph, cards, v, heuristic):
+    """
+    Score a variable under a heuristic, lower scores are eliminated first
+    """
+    neighbors = graph[v]
+    if heuristic == "minneighbors":
+        return len(neighbors)
+    elif heuristic == "minweight":
+        weight = cards[v]
+        for u in neighbors:
+            weight *= cards[u]
+        return weight
+    elif heuristic == "minfill" or heuristic == "weightedminfill":
+        fill = 0
+        nbrs = list(neighbors)
+        for i in range(len(nbrs)):
+            for j in range(i+1, len(nbrs)):
+                if nbrs[j] not in graph[nbrs[i]]:
+                    if heuristic == "minfill":
+                        fill += 1
+                    else:
+                        fill += cards[nbrs[i]] * cards[nbrs[j]]
+        return fill
+    else:
+        raise Exception("Error: ordering heuristic " + heuristic + " not recognized")
+
+def greedyOrdering(nVars, cliques, cards, heuristic, rng):
+    """
+    Build an elimination ordering by greedily eliminating the lowest scoring variable
+    """
+    graph = interactionGraph(nVars, cliques)
+    scores = dict((v, eliminationScore(graph, cards, v, heuristic)) for v in range(nVars))
+
+    order = []
+    while len(scores) > 0:
+        best = min(scores.values())
+        v = rng.choice(sorted(u for u in scores if scores[u] == best))
+        order.append(v)
+        del scores[v]
+
+        # Connect the neighbors of v and remove it from the graph
+        neighbors = graph[v]
+        for u in neighbors:
+            graph[u].discard(v)
+            graph[u].update(neighbors)
+            graph[u].discard(u)
+        graph[v] = set()
+
+        # Only variables within two steps of v can have a changed score
+        changed = set(neighbors)
+        if heuristic == "minfill" or heuristic == "weightedminfill":
+            for u in neighbors:
+                changed.update(graph[u])
+        for u in changed:
+            if u in scores:
+                scores[u] = eliminationScore(graph, cards, u, heuristic)
+
+    return order
+
+def orderingStats(nVars, cliques, cards, order):
+    """
+    Find the induced width and the largest factor size created by an elimination ordering
+    """
+    graph = interactionGraph(nVars, cliques)
+    width, maxSize = 0, 1
+    for v in order:
+        neighbors = graph[v]
+        width = max(width, len(neighbors))
+        size = cards[v]
+        for u in neighbors:
+            size *= cards[u]
+            graph[u].discard(v)
+            graph[u].update(neighbors)
+            graph[u].discard(u)
+        maxSize = max(maxSize, size)
+        graph[v] = set()
+    return width, maxSize
+
+def findOrdering(nVars, cliques, cards, heuristic="minneighbors", restarts=1, seed=0):
+    """
+    Run the greedy heuristic restarts times and keep the ordering with the smallest largest factor
+    """
+    rng = random.Random(seed)
+    bestOrder, bestStats = None, None
+    for i in range(max(1, restarts)):
+        order = greedyOrdering(nVars, cliques, cards, heuristic, rng)
+        width, maxSize = orderingStats(nVars, cliques, cards, order)
+        if bestStats is None or (maxSize, width) < bestStats:
+            bestOrder, bestStats = order, (maxSize, width)
+    return bestOrder
+
+def connectedComponents(nVars, cliques):
+    """
+    Split the variables into the connected components of the interaction graph
+    """
+    graph = interactionGraph(nVars, cliques)
+    component = [None] * nVars
+    components = []
+    for start in range(nVars):
+        if component[start] is not None:
+            continue
+        component[start] = len(components)
+        members, stack = [], [start]
+        while len(stack) > 0:
+            v = stack.pop()
+            members.append(v)
+            for u in graph[v]:
+                if component[u] is None:
+                    component[u] = len(components)
+                    stack.append(u)
+        components.append(sorted(members))
+    return components, component
+
+def groupCliques(nVars, cliques):
+    """
+    Group clique indices by connected component
+
+    Returns a list of (variables, clique indices) for every component with at least one
+    clique, and the indices of cliques with an empty scope, which belong to no component.
+    """
+    components, component = connectedComponents(nVars, cliques)
+    groups = [[] for c in components]
+    constants = []
+    for i in range(len(cliques)):
+        if len(cliques[i]) == 0:
+            constants.append(i)
+        else:
+            groups[component[cliques[i][0]]].append(i)
+    return [(components[c], groups[c]) for c in range(len(components)) if len(groups[c]) > 0], constants
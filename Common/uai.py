@@ -0,0 +1,269 @@
+"""
+Reader for Markov network files in the UAI format.
+
+The whole file is tokenized at once and every function table is converted in bulk into a
+single preallocated float64 buffer, so factor phi tables are views into that buffer.
+
+A parsed model can also be compiled into a binary cache file next to the UAI file. The cache
+holds the cardinalities, clique index arrays and packed tables, is loaded with a memory map,
+and is rebuilt whenever the size, modification time and hash of the UAI file no longer match.
+
+Author: Jordan Weiler
+Date:   October 18, 2026
+"""
+
+from factor import Factor, reduceFactors
+import numpy as np
+import os, struct, hashlib
+
+CACHE_SUFFIX = ".cache"
+CACHE_MAGIC = "UAICACHE"
+CACHE_VERSION = 1
+
+# magic, version, source size, source mtime, source sha1, nVars, nCliques, scope total, phi total
+CACHE_HEADER = struct.Struct("<8sqqd20s4xqqqq")
+
+class Model:
+    def __init__(self, nVars, cards, cliques, phi, offsets):
+        self.nVars = nVars          #number of variables
+        self.cards = cards          #cardinality of each variable
+        self.cliques = cliques      #variables in the scope of each function
+        self.phi = phi              #all function tables packed end to end
+        self.offsets = offsets      #start of each table in phi, plus the total size
+
+    def factors(self):
+        """
+        Create a Factor for each clique whose phi is a view into the packed table buffer
+        """
+        factors = []
+        for i in range(len(self.cliques)):
+            factors.append(Factor(self.cliques[i], self.cards, self.phi[self.offsets[i]:self.offsets[i+1]]))
+        return factors
+
+    def printM(self):
+        """
+        Print the model details
+        """
+        print "mnVars:", self.nVars
+        print "mnCards:", self.cards
+        print "mnCliques:", self.cliques, "\n"
+
+def readUAI(inFile):
+    """
+    Parse an opened UAI Markov network file into a Model
+    """
+    text = inFile.read()
+
+    header = text.split(None, 1)
+    if len(header) < 2 or header[0].lower() != "markov":
+        raise Exception("Error: Markov network input file needed")
+
+    # Every remaining token is numeric so convert them all in one pass
+    tokens = np.fromstring(header[1], dtype=np.float64, sep=" ")
+    pos = 0
+
+    def take(count):
+        if pos + count > len(tokens):
+            raise Exception("Error: unexpected end of input file " + inFile.name)
+        return tokens[pos:pos+count]
+
+    # Number of variables and their cardinalities
+    nVars = int(take(1)[0])
+    pos += 1
+    cards = [int(c) for c in take(nVars)]
+    pos += nVars
+
+    # Variable cliques
+    numCliques = int(take(1)[0])
+    pos += 1
+    cliques = []
+    for i in range(numCliques):
+        size = int(take(1)[0])
+        pos += 1
+        cliques.append([int(v) for v in take(size)])
+        pos += size
+
+    # Size of every function table is fixed by the cardinalities of its clique
+    offsets = np.zeros(numCliques + 1, dtype=np.int64)
+    for i in range(numCliques):
+        size = 1
+        for v in cliques[i]:
+            if v < 0 or v >= nVars:
+                raise Exception("Error: clique " + str(i) + " refers to unknown variable " + str(v))
+            size *= cards[v]
+        offsets[i+1] = offsets[i] + size
+
+    # Function tables
+    phi = np.empty(offsets[-1], dtype=np.float64)
+    for i in range(numCliques):
+        count = int(take(1)[0])
+        pos += 1
+        size = offsets[i+1] - offsets[i]
+        if count != size:
+            raise Exception("Error: function table " + str(i) + " has " + str(count) + " entries but its clique needs " + str(size))
+        phi[offsets[i]:offsets[i+1]] = take(size)
+        pos += size
+
+    return Model(nVars, cards, cliques, phi, offsets)
+
+def readEvidence(evidFile, model):
+    """
+    Parse an opened UAI evidence file into a variable to observed value map
+
+    The file lists the number of observed variables followed by variable and value pairs.
+    Older files start with the number of evidence samples, in which case the first is used.
+    A file too short for its first count is incomplete rather than an older file.
+    """
+    tokens = [int(t) for t in evidFile.read().split()]
+    if len(tokens) == 0:
+        return dict()
+    if len(tokens) < 1 + 2 * tokens[0]:
+        raise Exception("Error: evidence file " + evidFile.name + " is incomplete")
+    if len(tokens) == 1 + 2 * tokens[0]:
+        return parseSample(tokens, 0, model, evidFile.name)[0]
+
+    # Every sample of the older format has to parse before the first one is used
+    samples = parseSamples(tokens, model, evidFile.name)
+    if len(samples) == 0:
+        raise Exception("Error: evidence file " + evidFile.name + " has no samples")
+    return samples[0]
+
+def readEvidenceSets(evidFile, model):
+    """
+    Parse an opened UAI evidence file holding several samples into a list of evidence maps
+
+    The file starts with the number of samples, and each sample lists its number of observed
+    variables followed by variable and value pairs.
+    """
+    tokens = [int(t) for t in evidFile.read().split()]
+    if len(tokens) == 0:
+        return []
+    return parseSamples(tokens, model, evidFile.name)
+
+def parseSamples(tokens, model, name):
+    """
+    Parse a sample count followed by that many evidence samples, which must use every token
+    """
+    samples, pos = [], 1
+    for i in range(tokens[0]):
+        evidence, pos = parseSample(tokens, pos, model, name)
+        samples.append(evidence)
+    if pos != len(tokens):
+        raise Exception("Error: evidence file " + name + " has " + str(len(tokens) - pos) + " tokens left over")
+    return samples
+
+def parseSample(tokens, pos, model, name):
+    """
+    Parse one evidence sample starting at tokens[pos], returning it and the position after it
+    """
+    if len(tokens) < pos + 1 or len(tokens) < pos + 1 + 2 * tokens[pos]:
+        raise Exception("Error: evidence file " + name + " is incomplete")
+
+    evidence = dict()
+    for i in range(tokens[pos]):
+        v, value = tokens[pos + 1 + 2*i], tokens[pos + 2 + 2*i]
+        if v < 0 or v >= model.nVars or value < 0 or value >= model.cards[v]:
+            raise Exception("Error: evidence " + str(v) + " = " + str(value) + " is not a valid assignment")
+        evidence[v] = value
+    return evidence, pos + 1 + 2 * tokens[pos]
+
+def fileDigest(fileName):
+    """
+    Compute the sha1 digest of a file
+    """
+    sha = hashlib.sha1()
+    with open(fileName, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), ""):
+            sha.update(block)
+    return sha.digest()
+
+def writeCache(model, fileName, cacheName):
+    """
+    Write the compiled form of a model next to its UAI file
+    """
+    stat = os.stat(fileName)
+    scopeOffsets = np.zeros(len(model.cliques) + 1, dtype=np.int64)
+    for i in range(len(model.cliques)):
+        scopeOffsets[i+1] = scopeOffsets[i] + len(model.cliques[i])
+    scopes = np.array([v for c in model.cliques for v in c], dtype=np.int64)
+
+    header = CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, stat.st_size, stat.st_mtime, fileDigest(fileName),
+                               model.nVars, len(model.cliques), len(scopes), len(model.phi))
+
+    # Write to a temporary file first so concurrent runs never see a partial cache
+    tmpName = cacheName + "." + str(os.getpid())
+    with open(tmpName, "wb") as f:
+        f.write(header)
+        f.write(np.asarray(model.cards, dtype=np.int64).tostring())
+        f.write(scopeOffsets.tostring())
+        f.write(scopes.tostring())
+        f.write(np.asarray(model.offsets, dtype=np.int64).tostring())
+        f.write(np.asarray(model.phi, dtype=np.float64).tostring())
+    os.rename(tmpName, cacheName)
+
+def readCache(fileName, cacheName):
+    """
+    Memory map a compiled model, returning None if the cache is missing or stale
+    """
+    if not os.path.exists(cacheName) or os.path.getsize(cacheName) < CACHE_HEADER.size:
+        return None
+
+    buf = np.memmap(cacheName, dtype=np.uint8, mode="r")
+    magic, version, size, mtime, digest, nVars, nCliques, nScope, nPhi = CACHE_HEADER.unpack(buf[:CACHE_HEADER.size].tostring())
+    if magic != CACHE_MAGIC or version != CACHE_VERSION:
+        return None
+
+    # A touched but unchanged file is recognized by its hash
+    stat = os.stat(fileName)
+    if stat.st_size != size or (stat.st_mtime != mtime and fileDigest(fileName) != digest):
+        return None
+
+    pos = [CACHE_HEADER.size]
+    def take(dtype, count):
+        arr = np.frombuffer(buf, dtype=dtype, count=count, offset=pos[0])
+        pos[0] += arr.nbytes
+        return arr
+
+    cards = take(np.int64, nVars).tolist()
+    scopeOffsets = take(np.int64, nCliques + 1)
+    scopes = take(np.int64, nScope).tolist()
+    offsets = take(np.int64, nCliques + 1)
+    phi = take(np.float64, nPhi)
+
+    cliques = [scopes[scopeOffsets[i]:scopeOffsets[i+1]] for i in range(nCliques)]
+    return Model(nVars, cards, cliques, phi, offsets)
+
+def readNetwork(inFile, useCache, evidFileName=None, debug=False):
+    """
+    Read a model and slice its factors to the evidence in evidFileName, if one is given
+
+    Observed variables drop out of the scope of every factor. Returns the model, the
+    evidence map and the sliced factors.
+    """
+    model = readModel(inFile, useCache)
+    if debug: model.printM()
+
+    evidence = dict()
+    if evidFileName is not None:
+        with open(evidFileName, "r") as evidFile:
+            evidence = readEvidence(evidFile, model)
+        if debug: print "evidence:", evidence
+    return model, evidence, reduceFactors(model.factors(), evidence)
+
+def readModel(inFile, useCache):
+    """
+    Read a model from an opened UAI file, going through the compiled cache if requested
+    """
+    if not useCache:
+        return readUAI(inFile)
+
+    cacheName = inFile.name + CACHE_SUFFIX
+    model = readCache(inFile.name, cacheName)
+    if model is None:
+        model = readUAI(inFile)
+        try:
+            writeCache(model, inFile.name, cacheName)
+        except (IOError, OSError):
+            # The cache is only an optimization so an unwritable directory is not an error
+            pass
+    return model
@@ -0,0 +1,257 @@
+"""
+Markov Network Evaluator Using a Junction Tree
+
+This command line program reads in a Markov network file and prints out the partition function and the univariate marginals of the network. A clique tree is built from a variable elimination ordering and calibrated with one collect pass towards the roots and one distribute pass back out, so every marginal is exact. In the distribute pass each clique builds its belief once and the message to each child is divided out of it. The marginal distribution over each variable is printed on a single line, following the same variable order as in the file.
+
+Author: Jordan Weiler
+Date:   October 18, 2026
+
+ex. python jt.py file.uai
+"""
+
+import sys, os, math
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from factor import Factor, factorProductList, contractFactors, cardsOf, expandTable
+from uai import readNetwork
+from graph import HEURISTICS, findOrdering, interactionGraph
+import numpy as np
+
+global inFile
+global mnVars, mnCards, mnCliques, mnFactors
+global jtOrder, jtScopes, jtParents, jtChildren, jtPotentials, jtConstant
+global heuristic, restarts, seed
+global evidFileName, evidence
+global debug, useCache, showStats, logSpace
+
+def buildTree():
+    """
+    Build the clique tree created by eliminating the variables in order
+
+    Eliminating v creates the clique of v and its remaining neighbors. Its parent is the
+    clique of the first of those neighbors to be eliminated, which contains all of them.
+    """
+    global jtOrder, jtScopes, jtParents, jtChildren
+
+    jtOrder = findOrdering(mnVars, mnCliques, mnCards, heuristic, restarts, seed)
+    position = dict((jtOrder[i], i) for i in range(len(jtOrder)))
+    graph = interactionGraph(mnVars, mnCliques)
+
+    jtScopes, jtParents, jtChildren = dict(), dict(), dict()
+    for v in jtOrder:
+        jtChildren[v] = []
+
+    for v in jtOrder:
+        neighbors = graph[v]
+        jtScopes[v] = [v] + sorted(neighbors, key=lambda u: position[u])
+        jtParents[v] = jtScopes[v][1] if len(neighbors) > 0 else None
+        if jtParents[v] is not None:
+            jtChildren[jtParents[v]].append(v)
+
+        for u in neighbors:
+            graph[u].discard(v)
+            graph[u].update(neighbors)
+            graph[u].discard(u)
+        graph[v] = set()
+
+    if debug:
+        for v in jtOrder:
+            print "clique", v, "scope:", jtScopes[v], "parent:", jtParents[v]
+
+def calibrate():
+    """
+    Run the collect and distribute passes and return the partition function and marginals
+    """
+    # Collect: children are eliminated before their parents so follow the elimination order
+    upward = dict()
+    for v in jtOrder:
+        incoming = [jtPotentials[v]] + [upward[c] for c in jtChildren[v]]
+        upward[v] = contractFactors(incoming, [v], logSpace)
+
+    # The message out of each root is the partition function of its connected component
+    logZ = jtConstant
+    for v in jtOrder:
+        if jtParents[v] is None:
+            logZ += upward[v].logTotal()
+
+    # Distribute: parents are visited before their children in reverse elimination order
+    downward, beliefs = dict(), dict()
+    for p in reversed(jtOrder):
+        # The clique's belief is built once and every child's message is divided out of it
+        incoming = [jtPotentials[p]] + [upward[c] for c in jtChildren[p]]
+        if p in downward:
+            incoming.append(downward[p])
+        belief = contractFactors(incoming, [], logSpace)
+
+        for c in jtChildren[p]:
+            sepset = jtScopes[c][1:]
+            total = contractFactors([belief], [u for u in jtScopes[p] if u not in sepset], logSpace)
+            downward[c] = divideMessage(total, upward[c])
+
+        # The marginal of p comes from the calibrated belief of its own clique
+        beliefs[p] = contractFactors([belief], jtScopes[p][1:], logSpace)
+
+    marginals = []
+    for v in range(mnVars):
+        if v in evidence:
+            marginals.append(np.eye(mnCards[v])[evidence[v]])
+            continue
+        if v not in jtPotentials:
+            marginals.append(np.ones(mnCards[v]) / mnCards[v])
+            continue
+        belief = beliefs[v]
+        belief.renormalize()
+        marginals.append(belief.phi)
+
+    return logZ, marginals
+
+def divideMessage(total, message):
+    """
+    Divide a message out of a table over the same variables, taking 0 / 0 as 0
+
+    Where the message is zero the whole belief of the clique it came from is zero, so the
+    value sent back there does not matter.
+    """
+    cards = cardsOf(total)
+    divisor = expandTable(message, total.variables, cards)
+    zero = divisor == 0
+    quotient = Factor(total.variables, cards)
+    quotient.phi = np.where(zero, 0.0, total.table() / np.where(zero, 1.0, divisor)).ravel()
+    quotient.logScale = total.logScale - message.logScale
+    return quotient
+
+def closeFiles():
+    """
+    Close the input file
+    """
+    inFile.close()
+
+def initializePotentials():
+    """
+    Assign every factor to the clique of the first variable in its scope to be eliminated
+    """
+    global jtOrder, jtPotentials, jtConstant
+
+    position = dict((jtOrder[i], i) for i in range(len(jtOrder)))
+    assigned = dict()
+    jtConstant = 0.0
+    for f in mnFactors:
+        if len(f.variables) == 0:
+            jtConstant += f.logTotal()
+            continue
+        v = min(f.variables, key=lambda u: position[u])
+        assigned.setdefault(v, []).append(f)
+
+    # Cliques of variables that appear in no factor are left out of the tree
+    jtPotentials = dict()
+    for v in jtOrder:
+        if v not in assigned and len(jtScopes[v]) == 1 and len(jtChildren[v]) == 0:
+            continue
+        ones = Factor(jtScopes[v], mnCards)
+        ones.phi = np.ones(ones.size)
+        jtPotentials[v] = factorProductList([ones] + assigned.get(v, []))
+        if logSpace:
+            jtPotentials[v].rescale()
+
+    jtOrder = [v for v in jtOrder if v in jtPotentials]
+
+def parseInputArguments():
+    """
+    Parse the input arguments
+    """
+    global inFile, evidFileName, debug, useCache, showStats, logSpace
+    global heuristic, restarts, seed
+    debug = False
+    useCache = False
+    evidFileName = None
+    showStats = False
+    logSpace = False
+    heuristic = "minneighbors"
+    restarts = 1
+    seed = 0
+
+    args = sys.argv[1:]
+
+    if len(args) < 1:
+        raise Exception("Error: Input file required.")
+
+    inFile = open(args[0], "r")
+
+    if len(args) > 1:
+        for i in range(1, len(args)):
+            if args[i].lower() == "debug":
+                debug = True
+            elif args[i].lower() == "cache":
+                useCache = True
+            elif args[i].lower().startswith("evid="):
+                evidFileName = args[i].split("=", 1)[1]
+            elif args[i].lower() == "stats":
+                showStats = True
+            elif args[i].lower() == "log":
+                logSpace = True
+            elif args[i].lower().startswith("order="):
+                heuristic = args[i].split("=", 1)[1].lower()
+                if heuristic not in HEURISTICS:
+                    raise Exception("Error: ordering heuristic " + heuristic + " not recognized")
+            elif args[i].lower().startswith("restarts="):
+                restarts = int(args[i].split("=", 1)[1])
+            elif args[i].lower().startswith("seed="):
+                seed = int(args[i].split("=", 1)[1])
+            else:
+                raise Exception("Error: " + args[i] + " argument not recognized")
+
+def printMarginals(marginals):
+    """
+    Print out the marginals of the Markov network
+    """
+    output = ""
+    for varProb in marginals:
+        for x in varProb:
+            output += str(float(x)) + " "
+        output += "\n"
+
+    print output
+
+def readInputFile():
+    """
+    Read the preamble and function tables from the input file
+    """
+    global mnVars, mnCards, mnCliques, mnFactors, evidence
+
+    model, evidence, mnFactors = readNetwork(inFile, useCache, evidFileName, debug)
+    mnVars, mnCards = model.nVars, model.cards
+    mnCliques = [f.variables for f in mnFactors]
+
+def solveJT():
+    """
+    Build and calibrate the junction tree, then print the partition function and marginals
+    """
+    buildTree()
+
+    initializePotentials()
+
+    logZ, marginals = calibrate()
+
+    if logSpace:
+        print str(logZ)
+    elif logZ > math.log(sys.float_info.max):
+        print str(float("inf"))
+    else:
+        print str(math.exp(logZ))
+
+    printMarginals(marginals)
+
+    if showStats:
+        print "cliques:", len(jtOrder)
+        print "largest clique:", max([jtPotentials[v].size for v in jtOrder] + [1])
+
+if __name__ == "__main__":
+    """
+    The main function called when jt.py is run from the command line
+    """
+    parseInputArguments()
+
+    readInputFile()
+
+    solveJT()
+
+    closeFiles()
@@ -0,0 +1,669 @@
+"""
+FactorGraph class holds the compiled factor graph and all messages for belief propagation.
+
+There is one edge for every variable in the scope of every factor, numbered factor by factor.
+Each edge carries a factor to variable and a variable to factor message, and all messages in
+a direction are packed end to end in one contiguous array, with offsets giving where the
+message of each edge starts. Adjacency is stored as integer CSR index arrays, and every
+array is double-buffered so new messages are written beside the old ones and swapped in.
+
+For every factor, index arrays are compiled once that gather each incoming message onto the
+entries of the factor's table and reduce the table onto each of its variables, so computing a
+factor to variable message is a few vectorized operations into preallocated scratch space.
+Factors with the same cardinalities are also stacked into one table per shape, so a flooding
+iteration computes all messages of a group with one batched contraction per scope position.
+The states of variables with the same number of edges are stacked the same way, so all
+variable to factor messages come from products of the messages before and after each edge.
+
+In cavity mode the product of all incoming messages is formed once per node, and each
+outgoing message divides out the message coming back along its own edge. For factors this is
+done on the stacked tables of a group. Entries where that
+message is zero are filled in from the count of zero factors and the product of the nonzero
+ones, so deterministic tables are handled exactly.
+
+Messages can be updated by flooding, where every message is recomputed each iteration, or by
+residual belief propagation, where a priority queue always commits the pending factor to
+variable message that would change the most and only the messages that depend on it are
+recomputed and re-prioritized.
+
+A converged graph can be updated in place. New factor tables or evidence, which is kept as a
+0/1 weight on every variable state, are applied with update(), and only the messages that
+read them are queued. Residual updates then spread outwards from the previous fixed point, so
+a local change costs about as much as the messages it actually moves.
+
+A batched graph solves several evidence sets over the same factors at once. Every message
+buffer and the evidence weights get a leading instance axis, which all message operations
+carry through, and flooding sets aside each instance as soon as its messages converge.
+
+Flooding can also skip messages whose inputs have not moved. With a change threshold, an
+incoming message only counts as changed once it has moved by more than the threshold since it
+last counted as changed, and a message is recomputed only when one of its other incoming
+messages changed. Skipped messages keep their previous value and are counted.
+
+Author: Jordan Weiler
+Date:   October 18, 2026
+"""
+
+import numpy as np
+import heapq, time
+
+class FactorGraph:
+    def __init__(self, cards, factors, cavity=False, batch=None):
+        self.cards = cards
+        self.factors = factors
+        self.cavity = cavity
+        self.batch = batch      #number of evidence instances, or None for unbatched buffers
+
+        # Edges are numbered factor by factor so the edges of a factor are contiguous
+        edgeVar, edgeCard = [], []
+        self.factPtr = np.zeros(len(factors) + 1, dtype=np.int64)
+        for i in range(len(factors)):
+            edgeVar.extend(factors[i].variables)
+            edgeCard.extend(factors[i].card)
+            self.factPtr[i+1] = len(edgeVar)
+        self.nEdges = len(edgeVar)
+        self.edgeVar = np.array(edgeVar, dtype=np.int64)
+        self.edgeCard = np.array(edgeCard, dtype=np.int64)
+        self.edgeFact = np.repeat(np.arange(len(factors)), np.diff(self.factPtr))
+
+        # Start of the message of each edge, plus the total size
+        self.offsets = np.zeros(self.nEdges + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(self.edgeCard)
+
+        # Edges of each variable in CSR form
+        self.varEdges = np.argsort(self.edgeVar, kind="mergesort")
+        self.varPtr = np.zeros(len(cards) + 1, dtype=np.int64)
+        self.varPtr[1:] = np.cumsum(np.bincount(self.edgeVar, minlength=len(cards)))
+
+        # Variable state that each message entry refers to
+        self.varOffsets = np.zeros(len(cards) + 1, dtype=np.int64)
+        self.varOffsets[1:] = np.cumsum(cards)
+        local = np.arange(self.offsets[-1]) - np.repeat(self.offsets[:-1], self.edgeCard)
+        self.entryState = np.repeat(self.varOffsets[:-1][self.edgeVar], self.edgeCard) + local
+
+        size = self.offsets[-1]
+        prefix = () if batch is None else (batch,)
+        self.fToV, self.fToVNew = np.ones(prefix + (size,)), np.ones(prefix + (size,))
+        self.vToF, self.vToFNew = np.ones(prefix + (size,)), np.ones(prefix + (size,))
+
+        # Evidence weight of every variable state and the queue version of every edge
+        self.unary = np.ones(prefix + (self.varOffsets[-1],))
+        self.version = np.zeros(self.nEdges, dtype=np.int64)
+
+        # Change threshold for skipping flooding updates and the number of updates skipped
+        self.threshold = None
+        self.skipped = 0
+        self.firstPass = True
+
+        self.compileFactors()
+        self.compileGroups()
+        self.compileStates()
+        self.compileDegrees()
+
+    def compileFactors(self):
+        """
+        Build the gather and reduce index arrays and the scratch space of every factor
+
+        For entry n of a factor's table, assign[i][j][n] is the value of the factor's j-th
+        variable and gather[i][j][n] is where that value's message entry sits in a buffer.
+        """
+        self.assign, self.gather, self.scratch, self.taken = [], [], [], []
+        for i in range(len(self.factors)):
+            factor = self.factors[i]
+            entries = np.arange(factor.size)
+            assign, gather = [], []
+            for j in range(len(factor.variables)):
+                a = (entries // factor.stride[j]) % factor.card[j]
+                assign.append(a)
+                gather.append(self.offsets[self.factPtr[i] + j] + a)
+            self.assign.append(assign)
+            self.gather.append(gather)
+            self.scratch.append(np.empty(factor.size))
+            self.taken.append(np.empty(factor.size))
+
+    def compileGroups(self, members=None):
+        """
+        Stack the tables of factors that have the same cardinalities
+
+        groupTables[g] holds one table per factor of group g along a leading axis, and
+        groupIndex[g][j][r] lists where the message of the r-th factor's j-th variable sits
+        in a buffer. groupOf[i] is the group and row of factor i. Only the factors listed in
+        members are grouped if it is given.
+        """
+        if members is None:
+            members = range(len(self.factors))
+        shapes = dict()
+        for i in members:
+            if len(self.factors[i].variables) > 0:
+                shapes.setdefault(tuple(self.factors[i].card), []).append(i)
+
+        self.groupFactors, self.groupTables, self.groupIndex = [], [], []
+        self.groupOf = dict()
+        for card in sorted(shapes):
+            members = shapes[card]
+            for r in range(len(members)):
+                self.groupOf[members[r]] = (len(self.groupFactors), r)
+            self.groupFactors.append(np.array(members, dtype=np.int64))
+            self.groupTables.append(np.array([self.factors[i].phi for i in members]).reshape((len(members),) + card))
+            index = []
+            for j in range(len(card)):
+                starts = self.offsets[self.factPtr[members] + j]
+                index.append(starts[:, None] + np.arange(card[j])[None, :])
+            self.groupIndex.append(index)
+
+    def compileStates(self, entries=None):
+        """
+        Group message entries by the variable state they refer to
+
+        stateEntries lists the grouped entries, or is None when every entry is grouped.
+        stateOrder sorts them by state, stateStarts is where each state's run starts in that
+        order and stateGroup[n] is the run of the n-th grouped entry. Only the entries listed
+        in entries are grouped if it is given.
+        """
+        self.stateEntries = entries
+        states = self.entryState if entries is None else self.entryState[entries]
+        self.stateOrder = np.argsort(states, kind="mergesort")
+        sortedStates = states[self.stateOrder]
+        self.stateStarts = np.flatnonzero(np.diff(np.r_[-1, sortedStates]))
+        self.stateGroup = np.empty(len(states), dtype=np.int64)
+        self.stateGroup[self.stateOrder] = np.cumsum(np.diff(np.r_[-1, sortedStates]) != 0) - 1
+
+    def compileDegrees(self):
+        """
+        Stack the incoming message entries of variable states with the same number of edges
+
+        degreeIndex[d] has one row for every state of every variable in degree group d, listing
+        where that state's entry of each of the variable's messages sits in a buffer.
+        degreeStates[d] is the variable state of each row.
+        """
+        rows = dict()
+        for v in range(len(self.cards)):
+            edges = self.varEdges[self.varPtr[v]:self.varPtr[v+1]]
+            if len(edges) == 0:
+                continue
+            index, states = rows.setdefault(len(edges), ([], []))
+            for s in range(self.cards[v]):
+                index.append(self.offsets[edges] + s)
+                states.append(self.varOffsets[v] + s)
+
+        self.degreeIndex, self.degreeStates = [], []
+        for degree in sorted(rows):
+            index, states = rows[degree]
+            self.degreeIndex.append(np.array(index, dtype=np.int64))
+            self.degreeStates.append(np.array(states, dtype=np.int64))
+
+    def computeFtoVMessage(self, i, k, vToF, out):
+        """
+        Compute the unnormalized message from factor i to its k-th variable into out
+        """
+        factor = self.factors[i]
+        prod, taken = self.scratch[i], self.taken[i]
+        np.copyto(prod, factor.phi)
+        for j in range(len(self.gather[i])):
+            if j != k:
+                np.take(vToF, self.gather[i][j], out=taken)
+                prod *= taken
+        out[:] = np.bincount(self.assign[i][k], weights=prod, minlength=factor.card[k])
+
+    def computeFtoVMessagesGroupCavity(self, g, vToF, out, needed=None):
+        """
+        Compute the unnormalized messages from every factor of group g to all of its variables
+        by dividing each incoming message out of the full product
+
+        The stacked tables are multiplied by every incoming message once, and each scope
+        position sums the product with its own incoming message divided back out. If needed
+        is given, only factors with an edge marked in it are computed.
+        """
+        tables, index = self.groupTables[g], self.groupIndex[g]
+        arity = len(index)
+        rows = slice(None)
+        if needed is not None:
+            starts = self.factPtr[self.groupFactors[g]]
+            rows = np.flatnonzero(np.any([needed[starts + k] for k in range(arity)], axis=0))
+            if len(rows) == 0:
+                return
+
+        # Shape every incoming message to broadcast along its own axis of the stacked tables
+        incoming = []
+        for j in range(arity):
+            msg = vToF[..., index[j][rows]]
+            incoming.append(msg.reshape(msg.shape[:-1] + (1,) * j + msg.shape[-1:] + (1,) * (arity - j - 1)))
+        axes = [tuple(j - arity for j in range(arity) if j != k) for k in range(arity)]
+
+        prod = tables[rows]
+        if all(msg.all() for msg in incoming):
+            for msg in incoming:
+                prod = prod * msg
+            for k in range(arity):
+                out[..., index[k][rows]] = (prod / incoming[k]).sum(axis=axes[k])
+            return
+
+        # With zero entries divide only where nothing else is zero, otherwise use the count of zeros
+        zeros = 0
+        for msg in incoming:
+            zeros = zeros + (msg == 0)
+            prod = prod * np.where(msg == 0, 1.0, msg)
+        for k in range(arity):
+            isZero = incoming[k] == 0
+            excluded = np.where(isZero, np.where(zeros == 1, prod, 0.0), np.where(zeros == 0, prod / np.where(isZero, 1.0, incoming[k]), 0.0))
+            out[..., index[k][rows]] = excluded.sum(axis=axes[k])
+
+    def computeFtoVMessagesGroup(self, g, vToF, out, needed=None):
+        """
+        Compute the unnormalized messages from every factor of group g to all of its variables
+
+        Axis 0 of every operand runs over the factors of the group, so each scope position is
+        one contraction of the stacked tables with the other positions' incoming messages.
+        Any instance axes of a batched graph lead the messages and are carried through. If
+        needed is given, only the messages of edges marked in it are computed.
+        """
+        tables, index = self.groupTables[g], self.groupIndex[g]
+        incoming = [vToF[..., idx] for idx in index]
+        arity = len(index)
+        for k in range(arity):
+            rows = slice(None)
+            if needed is not None:
+                rows = np.flatnonzero(needed[self.factPtr[self.groupFactors[g]] + k])
+                if len(rows) == 0:
+                    continue
+            operands = [tables[rows], range(arity + 1)]
+            for j in range(arity):
+                if j != k:
+                    operands += [incoming[j][..., rows, :], [Ellipsis, 0, j + 1]]
+            out[..., index[k][rows]] = np.einsum(*(operands + [[Ellipsis, 0, k + 1]]))
+
+    def computeVtoFMessage(self, e, fToV, out):
+        """
+        Compute the unnormalized message along edge e from its variable into out
+        """
+        v = self.edgeVar[e]
+        out[:] = self.unary[..., self.varOffsets[v]:self.varOffsets[v+1]]
+        for other in self.varEdges[self.varPtr[v]:self.varPtr[v+1]]:
+            if other != e:
+                out *= self.message(fToV, other)
+
+    def beliefs(self):
+        """
+        Multiply the incoming factor to variable messages of each variable and normalize
+        """
+        marginals = []
+        for v in range(len(self.cards)):
+            belief = self.unary[..., self.varOffsets[v]:self.varOffsets[v+1]].copy()
+            for e in self.varEdges[self.varPtr[v]:self.varPtr[v+1]]:
+                belief *= self.message(self.fToV, e)
+            marginals.append(normalize(belief))
+        return marginals
+
+    def markChanged(self, buf, ref):
+        """
+        Find the edges whose message moved by more than the threshold from its reference copy,
+        and make their current message the new reference
+        """
+        changed = self.edgeChange(buf, ref) > self.threshold
+        entries = np.repeat(changed, self.edgeCard)
+        ref[entries] = buf[entries]
+        return changed
+
+    def edgeChange(self, buf, ref):
+        """
+        Largest change in any entry of each edge's message between two message buffers
+        """
+        return np.maximum.reduceat(np.abs(buf - ref), self.offsets[:-1])
+
+    def message(self, buf, e):
+        """
+        View the message of an edge in a message buffer
+        """
+        return buf[..., self.offsets[e]:self.offsets[e+1]]
+
+    def normalizeMessages(self, buf):
+        """
+        Normalize every message in a buffer to add up to 1.0, making all zero messages uniform
+        """
+        if self.nEdges == 0:
+            return
+        normalizeSegments(buf, self.offsets[:-1], self.edgeCard)
+
+    def printM(self):
+        """
+        Print out the details of every message
+        """
+        for e in range(self.nEdges):
+            v, f = self.edgeVar[e], self.edgeFact[e]
+            print "M " + str(v) + " -> F" + str(f) + " = " + str(self.message(self.vToF, e))
+            print "M F" + str(f) + " -> " + str(v) + " = " + str(self.message(self.fToV, e))
+
+    def pushCandidate(self, heap, e):
+        """
+        Compute the pending message along edge e from its factor and queue it by its residual
+        """
+        i = self.edgeFact[e]
+        candidate = self.message(self.fToVNew, e)
+        self.computeFtoVMessage(i, e - self.factPtr[i], self.vToF, candidate)
+        candidate[:] = normalize(candidate)
+        self.version[e] += 1
+        residual = np.abs(candidate - self.message(self.fToV, e)).max()
+        heapq.heappush(heap, (-residual, e, self.version[e]))
+
+    def damp(self, damping):
+        """
+        Mix the old factor to variable messages into the new ones
+        """
+        if damping > 0:
+            self.fToVNew *= 1.0 - damping
+            self.fToVNew += damping * self.fToV
+
+    def residual(self):
+        """
+        Largest change in any entry of any message, the max-norm of the worst message
+
+        A batched graph returns the residual of every instance.
+        """
+        if self.nEdges == 0:
+            return np.zeros(self.fToV.shape[:-1])
+        return np.maximum(np.abs(self.fToVNew - self.fToV).max(axis=-1), np.abs(self.vToFNew - self.vToF).max(axis=-1))
+
+    def runFlooding(self, tolerance=0.00001, maxIterations=50, damping=0.0, deadline=None, threshold=None):
+        """
+        Update every message in each iteration until no message changes by tolerance or more
+
+        Stops early once time.time() passes the deadline. Returns the number of iterations
+        and whether the run converged, for every instance of a batched graph. With a change
+        threshold, messages whose inputs have not changed are skipped and counted in skipped.
+        A damped message is still recomputed while its own last update moved it by more than
+        the threshold, since it has not reached the value its inputs give yet.
+        """
+        if self.batch is not None:
+            if threshold is not None:
+                raise Exception("Error: skipping unchanged messages does not support batched evidence")
+            return self.runFloodingBatch(tolerance, maxIterations, damping, deadline)
+
+        # Every message is computed in the first iteration, which also sets the references
+        self.threshold, self.skipped, self.firstPass, self.moving = threshold, 0, True, False
+        if threshold is not None and self.nEdges > 0:
+            self.refFtoV = np.full(self.offsets[-1], np.inf)
+            self.refVtoF = np.full(self.offsets[-1], np.inf)
+
+        for loop in range(maxIterations):
+            if deadline is not None and time.time() >= deadline:
+                return loop, False
+
+            # Update messages in both directions into the spare buffers
+            self.updateFtoVMessages()
+            self.damp(damping)
+            if threshold is not None and damping > 0 and self.nEdges > 0:
+                self.moving = self.edgeChange(self.fToVNew, self.fToV) > threshold
+            self.updateVtoFMessages()
+
+            # Compare differences with the last messages, then make the new messages current
+            diff = self.residual()
+            self.swap()
+            self.firstPass = False
+            if diff < tolerance:
+                return loop + 1, True
+
+        return maxIterations, False
+
+    def runFloodingBatch(self, tolerance, maxIterations, damping, deadline):
+        """
+        Run flooding on every instance of a batched graph
+
+        Instances whose messages have converged are copied out of the working buffers, so
+        later iterations only compute the instances that are still changing.
+        """
+        fToV, vToF, unary = self.fToV, self.vToF, self.unary
+        rows = np.arange(self.batch)
+        iterations = np.zeros(self.batch, dtype=np.int64)
+        converged = np.zeros(self.batch, dtype=bool)
+        for loop in range(maxIterations):
+            if len(rows) == 0 or (deadline is not None and time.time() >= deadline):
+                break
+
+            self.updateFtoVMessages()
+            self.damp(damping)
+            self.updateVtoFMessages()
+            diff = self.residual()
+            self.swap()
+            iterations[rows] += 1
+
+            done = diff < tolerance
+            if done.any():
+                converged[rows[done]] = True
+                fToV[rows], vToF[rows] = self.fToV, self.vToF
+                rows = rows[~done]
+                self.fToV, self.vToF, self.unary = fToV[rows], vToF[rows], unary[rows]
+                self.fToVNew, self.vToFNew = np.empty_like(self.fToV), np.empty_like(self.vToF)
+
+        fToV[rows], vToF[rows] = self.fToV, self.vToF
+        self.fToV, self.vToF, self.unary = fToV, vToF, unary
+        self.fToVNew, self.vToFNew = np.empty_like(fToV), np.empty_like(vToF)
+        return iterations, converged
+
+    def runResidual(self, tolerance=0.00001, maxUpdates=None, damping=0.0, deadline=None):
+        """
+        Run residual belief propagation until no pending message changes by tolerance or more
+
+        Returns the number of messages committed and whether the run converged.
+        """
+        if self.batch is not None:
+            raise Exception("Error: the residual schedule does not support batched evidence")
+
+        # Messages are only recomputed from their other edges later on, so a variable's
+        # evidence has to be in its messages before the queue is built
+        self.computeVtoFMessages(self.fToV, self.vToF)
+        self.normalizeMessages(self.vToF)
+
+        heap = []
+        for e in range(self.nEdges):
+            self.pushCandidate(heap, e)
+        return self.propagate(heap, tolerance, maxUpdates, damping, deadline)
+
+    def propagate(self, heap, tolerance, maxUpdates, damping, deadline):
+        """
+        Commit queued messages in order of residual until none changes by tolerance or more
+
+        The pending factor to variable messages are kept in fToVNew. A damped update only
+        moves part of the way to the pending message, so the edge is queued again.
+        """
+        if maxUpdates is None:
+            maxUpdates = 50 * self.nEdges
+
+        updates = 0
+        converged = True
+        while len(heap) > 0:
+            residual, e, version = heapq.heappop(heap)
+            if version != self.version[e]:
+                continue
+            if -residual < tolerance:
+                break
+            if updates >= maxUpdates or (deadline is not None and time.time() >= deadline):
+                converged = False
+                break
+
+            # Commit the message with the largest residual
+            msg = self.message(self.fToV, e)
+            msg *= damping
+            msg += (1.0 - damping) * self.message(self.fToVNew, e)
+            self.version[e] += 1
+            updates += 1
+            if damping > 0:
+                self.pushCandidate(heap, e)
+
+            # Only messages out of the variable, and the factor messages that read them, change
+            self.refreshVariable(heap, self.edgeVar[e], e)
+
+        return updates, converged
+
+    def refreshVariable(self, heap, v, skip=None):
+        """
+        Recompute the messages out of variable v, except along edge skip, and queue the
+        factor to variable messages that read them
+        """
+        for e in self.varEdges[self.varPtr[v]:self.varPtr[v+1]]:
+            if e == skip:
+                continue
+            msg = self.message(self.vToF, e)
+            self.computeVtoFMessage(e, self.fToV, msg)
+            msg[:] = normalize(msg)
+
+            i = self.edgeFact[e]
+            for target in range(self.factPtr[i], self.factPtr[i+1]):
+                if target != e:
+                    self.pushCandidate(heap, target)
+
+    def setEvidence(self, v, value, instance=None):
+        """
+        Observe variable v at value, or remove its evidence when value is None
+
+        In a batched graph the evidence is set in one instance, or in all of them by default.
+        """
+        weight = self.unary[..., self.varOffsets[v]:self.varOffsets[v+1]]
+        if instance is not None:
+            weight = weight[instance]
+        if value is None:
+            weight.fill(1.0)
+        else:
+            if value < 0 or value >= self.cards[v]:
+                raise Exception("Error: evidence " + str(v) + " = " + str(value) + " is not a valid assignment")
+            weight.fill(0.0)
+            weight[..., value] = 1.0
+
+    def swap(self):
+        """
+        Make the new messages current, reusing the old arrays for the next update
+        """
+        self.fToV, self.fToVNew = self.fToVNew, self.fToV
+        self.vToF, self.vToFNew = self.vToFNew, self.vToF
+
+    def update(self, factors=None, evidence=None, tolerance=0.00001, maxUpdates=None, damping=0.0, deadline=None):
+        """
+        Change factor tables or evidence and re-converge starting from the current messages
+
+        factors maps a factor index to its new table and evidence maps a variable to its
+        observed value, or to None to remove its evidence. Returns the number of messages
+        committed and whether the run converged.
+        """
+        if self.batch is not None:
+            raise Exception("Error: incremental updates do not support batched evidence")
+        heap = []
+        for i, phi in (factors or dict()).items():
+            self.factors[i].setPhi(phi)
+            g, r = self.groupOf[i]
+            self.groupTables[g][r] = self.factors[i].table()
+            for e in range(self.factPtr[i], self.factPtr[i+1]):
+                self.pushCandidate(heap, e)
+        for v, value in (evidence or dict()).items():
+            self.setEvidence(v, value)
+            self.refreshVariable(heap, v)
+        return self.propagate(heap, tolerance, maxUpdates, damping, deadline)
+
+    def updateFtoVMessages(self):
+        """
+        Compute new factor to variable messages from the current variable to factor messages
+        """
+        needed = None
+        if self.threshold is not None and self.nEdges > 0:
+            # A message is needed when another edge of its factor brought a changed message,
+            # or its last damped update still moved it
+            changed = self.markChanged(self.vToF, self.refVtoF)
+            count = np.bincount(self.edgeFact, weights=changed, minlength=len(self.factors))
+            needed = (count[self.edgeFact] - changed > 0) | self.firstPass | self.moving
+            np.copyto(self.fToVNew, self.fToV)
+
+        if self.cavity:
+            # The cavity update computes all of a factor's messages at once
+            if needed is not None:
+                needed = (np.bincount(self.edgeFact, weights=needed, minlength=len(self.factors)) > 0)[self.edgeFact]
+            for g in range(len(self.groupTables)):
+                self.computeFtoVMessagesGroupCavity(g, self.vToF, self.fToVNew, needed)
+            if needed is not None:
+                self.skipped += self.nEdges - needed.sum()
+        else:
+            for g in range(len(self.groupTables)):
+                self.computeFtoVMessagesGroup(g, self.vToF, self.fToVNew, needed)
+            if needed is not None:
+                self.skipped += self.nEdges - needed.sum()
+        self.normalizeMessages(self.fToVNew)
+
+    def updateVtoFMessages(self):
+        """
+        Compute new variable to factor messages from the new factor to variable messages
+        """
+        needed = None
+        if self.threshold is not None and self.nEdges > 0:
+            # A message is needed when another edge of its variable brought a changed message
+            changed = self.markChanged(self.fToVNew, self.refFtoV)
+            count = np.bincount(self.edgeVar, weights=changed, minlength=len(self.cards))
+            needed = (count[self.edgeVar] - changed > 0) | self.firstPass
+
+        if self.cavity:
+            # The vectorized cavity update is cheaper to run in full than to mask
+            self.computeVtoFMessagesCavity(self.fToVNew, self.vToFNew)
+            self.normalizeMessages(self.vToFNew)
+            return
+
+        self.computeVtoFMessages(self.fToVNew, self.vToFNew)
+        if needed is not None:
+            # Skipped messages keep their previous value
+            kept = np.repeat(~needed, self.edgeCard)
+            self.vToFNew[kept] = self.vToF[kept]
+            self.skipped += self.nEdges - needed.sum()
+        self.normalizeMessages(self.vToFNew)
+
+    def computeVtoFMessages(self, fToV, out):
+        """
+        Compute every variable to factor message at once
+
+        Within each degree group the incoming messages of a state lie along one axis, so the
+        product of all the others is the product of those before and after each one.
+        """
+        for index, states in zip(self.degreeIndex, self.degreeStates):
+            incoming = fToV[..., index]
+            before, after = np.ones(incoming.shape), np.ones(incoming.shape)
+            np.cumprod(incoming[..., :-1], axis=-1, out=before[..., 1:])
+            after[..., :-1] = np.cumprod(incoming[..., :0:-1], axis=-1)[..., ::-1]
+            out[..., index] = before * after * self.unary[..., states][..., None]
+
+    def computeVtoFMessagesCavity(self, fToV, out):
+        """
+        Compute every variable to factor message at once by dividing each incoming message
+        out of the product of all incoming messages of its variable state
+
+        Only the entries grouped by compileStates are computed, which covers every edge of the
+        variables they belong to.
+        """
+        entries = slice(None) if self.stateEntries is None else self.stateEntries
+        if len(self.stateOrder) == 0:
+            return
+
+        # Product of the nonzero incoming entries and the number of zero entries per state
+        incoming = fToV[..., entries]
+        isZero = incoming == 0
+        nonzero = np.where(isZero, 1.0, incoming)
+        prod = np.multiply.reduceat(nonzero[..., self.stateOrder], self.stateStarts, axis=-1)
+        zeros = np.add.reduceat(isZero[..., self.stateOrder].astype(np.int64), self.stateStarts, axis=-1)
+
+        full = prod[..., self.stateGroup] * self.unary[..., self.entryState[entries]]
+        count = zeros[..., self.stateGroup]
+        out[..., entries] = np.where(isZero, np.where(count == 1, full, 0.0), np.where(count == 0, full / nonzero, 0.0))
+
+def normalizeSegments(values, starts, cards):
+    """
+    Normalize consecutive segments of values in place to add up to 1.0 along the last axis,
+    making all zero segments uniform
+    """
+    sums = np.add.reduceat(values, starts, axis=-1)
+    zero = sums == 0
+    sums[zero] = 1.0
+    values /= np.repeat(sums, cards, axis=-1)
+    if zero.any():
+        uniform = np.repeat(1.0 / cards, cards)
+        np.copyto(values, uniform, where=np.repeat(zero, cards, axis=-1))
+
+def normalize(values):
+    """
+    Normalize values to add up to 1.0 along the last axis, making all zero values uniform
+    """
+    tot = values.sum(axis=-1)[..., None]
+    zero = tot == 0
+    return np.where(zero, 1.0 / values.shape[-1], values / np.where(zero, 1.0, tot))
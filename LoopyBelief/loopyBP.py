@@ -9,13 +9,18 @@ Date:   May 31, 2013
 ex. python loopyBP.py file.uai
 """
 
-from factor import Factor
-from message import Message
-import sys, math, datetime
+import sys, os, datetime, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from uai import readNetwork, readEvidenceSets
+from factorgraph import FactorGraph
+from partition import partitionGraph, cutEdges, runPartitioned
 
 global inFile
 global mnVars, mnCards, mnCliques, mnFactors, mnMarginals
-global showTime, debug
+global fg
+global evidFileName, evidence, batchFileName, evidenceSets
+global showTime, debug, cavity, schedule, showStats
+global maxIterations, tolerance, damping, timeLimit, procs, threshold
 
 def closeFiles():
     """
@@ -25,96 +30,42 @@ def closeFiles():
 
 def createMessages():
     """
-    Create the variable to factor and factor to variable messages
+    Compile the factor graph holding the variable to factor and factor to variable messages
     """
-    global vToF, fToV, dictVtoF, dictFtoV
-    vToF, fToV = [], []
-    for i in range(len(mnFactors)):
-        vrbls = mnFactors[i].variables
-        for j in range(len(vrbls)):
-            vToF.append(Message(vrbls[j], i, True, mnFactors[i].card[j]))
-            fToV.append(Message(vrbls[j], i, False, mnFactors[i].card[j]))
-            
-    dictVtoF, dictFtoV = dict(), dict()
-    
-    for i in range(len(vToF)):
-        if debug:
-            print "V to F Message"
-            vToF[i].printM()
-
-        key = str(vToF[i].fact)
-        if key not in dictVtoF:
-            dictVtoF[key] = []
-        dictVtoF[key].append(i)
-    
-        if debug:
-            print "F to V Message"
-            fToV[i].printM()
+    global fg
+    if evidenceSets is None:
+        fg = FactorGraph(mnCards, mnFactors, cavity)
+    else:
+        # Every evidence set is one instance of a batched graph over the unreduced factors
+        fg = FactorGraph(mnCards, mnFactors, cavity, len(evidenceSets))
+        for r in range(len(evidenceSets)):
+            for v, value in evidenceSets[r].items():
+                fg.setEvidence(v, value, r)
 
-        key = str(fToV[i].var)
-        if key not in dictFtoV:
-            dictFtoV[key] = []
-        dictFtoV[key].append(i)
-    
-    if debug: 
-        print ""
-        print "V to F"
-        print dictVtoF
-        print ""
-        print "F to V"
-        print dictFtoV
-        print ""
-        
-def multiplyFactorAndMessages(factor, msgList, varToIgnore):
-    """
-    Multiply factor and messages together
-    """
     if debug:
-        print "Before multiplying messages"
-        factor.printF()
-        print "Message List"
-        print msgList
-        print "Ignoring ", varToIgnore
-    
-    for msg in msgList:
-        if vToF[msg].var != varToIgnore:
-            varIndex = factor.variables.index(vToF[msg].var)
-            
-            updatedPhi = [False for x in range(factor.size)]
-            
-            numUpdates = factor.size / factor.card[varIndex]
-            
-            for i in range(factor.card[varIndex]):
-                phiIndex = 0
-                for j in range(factor.size):
-                    if updatedPhi[j] == False:
-                        phiIndex = j
-                        break
-                
-                updates = 0
-                while updates < numUpdates:
-                    strideCnt = 0
-                    while strideCnt < factor.stride[varIndex]:
-                        factor.phi[phiIndex] *= vToF[msg].val[i]
-                        updatedPhi[phiIndex] = True
-                        
-                        strideCnt += 1
-                        updates += 1
-                        phiIndex += 1
-                    phiIndex += factor.stride[varIndex] * (factor.card[varIndex] - 1)
-    if debug: 
-        print "After multiplying messages"
-        factor.printF()
-    
-    return factor
-        
+        fg.printM()
+        print ""
+
 def parseInputArguments():
     """
     Read in all input arguments and set global variables
     """
-    global inFile, showTime, debug
+    global inFile, evidFileName, batchFileName, showTime, debug, useCache, cavity, schedule, showStats
+    global maxIterations, tolerance, damping, timeLimit, procs, threshold
     showTime = False
+    showStats = False
+    maxIterations = 50
+    tolerance = 0.00001
+    damping = 0.0
+    timeLimit = None
+    procs = 1
+    threshold = None
     debug = False
+    useCache = False
+    cavity = False
+    schedule = "flooding"
+    evidFileName = None
+    batchFileName = None
 
     args = sys.argv[1:]
     
@@ -129,279 +80,128 @@ def parseInputArguments():
                 showTime = True
             elif args[i].lower() == "debug":
                 debug = True
+            elif args[i].lower() == "cache":
+                useCache = True
+            elif args[i].lower() == "cavity":
+                cavity = True
+            elif args[i].lower().startswith("schedule="):
+                schedule = args[i].split("=", 1)[1].lower()
+                if schedule not in ["flooding", "residual"]:
+                    raise Exception("Error: schedule " + schedule + " not recognized")
+            elif args[i].lower().startswith("evid="):
+                evidFileName = args[i].split("=", 1)[1]
+            elif args[i].lower().startswith("batch="):
+                batchFileName = args[i].split("=", 1)[1]
+            elif args[i].lower() == "stats":
+                showStats = True
+            elif args[i].lower().startswith("maxiter="):
+                maxIterations = int(args[i].split("=", 1)[1])
+            elif args[i].lower().startswith("tol="):
+                tolerance = float(args[i].split("=", 1)[1])
+            elif args[i].lower().startswith("damping="):
+                damping = float(args[i].split("=", 1)[1])
+                if damping < 0 or damping >= 1:
+                    raise Exception("Error: damping must be at least 0 and less than 1")
+            elif args[i].lower().startswith("deadline="):
+                timeLimit = float(args[i].split("=", 1)[1])
+            elif args[i].lower().startswith("procs="):
+                procs = int(args[i].split("=", 1)[1])
+            elif args[i].lower().startswith("skip="):
+                threshold = float(args[i].split("=", 1)[1])
             else:
                 raise Exception("Error: " + args[i] + " argument not recognized")
 
-def printMarginals():
+    if batchFileName is not None and (evidFileName is not None or schedule == "residual"):
+        raise Exception("Error: batch cannot be combined with evid or the residual schedule")
+    if procs > 1 and (batchFileName is not None or schedule == "residual"):
+        raise Exception("Error: procs cannot be combined with batch or the residual schedule")
+    if threshold is not None and (batchFileName is not None or schedule == "residual" or procs > 1):
+        raise Exception("Error: skip cannot be combined with batch, procs or the residual schedule")
+
+def printMarginals(beliefs):
     """
     Print out the marginals of the Markov network
     """
     marginals = ""
-    
+
     for i in range(mnVars):
-        msg = dictFtoV[str(i)]
-        
-        varProb = []
-        varTot = 0.0
-        size = len(msg)
-        if size > 0:
-            card = len(fToV[msg[0]].val)
-            
-            for j in range(card):
-                tot = 1.0
-                for k in range(size):
-                    tot *= fToV[msg[k]].val[j]
-                varProb.append(tot)
-                varTot += tot
+        varProb = beliefs[i]
+        if i in evidence:
+            # Observed variables put all of their mass on the observed value
+            varProb = [0.0] * mnCards[i]
+            varProb[evidence[i]] = 1.0
 
-        for j in range(len(varProb)):
-            varProb[j] = varProb[j] / varTot
-        
         for x in varProb:
-            marginals += str(x) + " "
+            marginals += str(float(x)) + " "
         marginals += "\n"
     
     print marginals 
 
-def readFunctionTables():
-    """
-    Reads function tables defined in the input file
-    """
-    global mnFactors
-    mnFactors = []
-    factorIndex, factorNum = 0, 0
-
-    fClass = Factor(mnCliques[factorIndex], mnCards)
-    
-    factor = []
-    done = False
-    while not done:
-        inputRow = inFile.readline().strip()
-        if inputRow == "":
-            continue
-        else:
-            if " " in inputRow:
-                splitRow = inputRow.split()
-                if factorNum == 0:
-                    factorNum = int(splitRow[0])
-                    for i in range(1, len(splitRow)):
-                        factor.append(float(splitRow[i]))
-                else:
-                    for i in range(len(splitRow)):
-                        factor.append(float(splitRow[i]))
-                        
-                if factorNum == len(factor):
-                    # Reset for next factor
-                    factorNum = 0
-                    fClass.phi = factor
-                    mnFactors.append(fClass)
-                    factor = []
-                    factorIndex += 1
-                    if factorIndex < len(mnCliques):
-                        fClass = Factor(mnCliques[factorIndex], mnCards)
-            else:
-                factorNum = int(inputRow)
-                
-        if len(mnFactors) >= len(mnCliques):
-            # All cliques have been read so break out of while loop 
-            done = True
-    if debug:
-        for i in range(len(mnFactors)):
-            mnFactors[i].printF()
-
 def readInputFile():
     """
     Read the preamble and function tables from the input file
     """
-    readPreamble()
-	
-    readFunctionTables()
+    global mnVars, mnCards, mnCliques, mnFactors, evidence, evidenceSets
 
-def readPreamble():
-    """
-    Reads preamble defined in the input file
-    """
-    global mnVars, mnCards, mnCliques
-    
-    inputRow = inFile.readline().strip()
-    if inputRow.lower() == "markov":
-        # Number of variables
-        mnVars = int(inFile.readline().strip())
+    model, evidence, mnFactors = readNetwork(inFile, useCache, evidFileName, debug)
+    mnVars, mnCards = model.nVars, model.cards
+    mnCliques = [f.variables for f in mnFactors]
 
-        if debug: print "mnVars:", mnVars
-        
-        # Variable cardinality
-        mnCards = []
-        cardinalityAr = inFile.readline().strip().split()
-        for c in cardinalityAr:
-            mnCards.append(int(c))
+    # Evidence sets are applied as weights inside the factor graph instead
+    evidenceSets = None
+    if batchFileName is not None:
+        with open(batchFileName, "r") as batchFile:
+            evidenceSets = readEvidenceSets(batchFile, model)
+        if debug: print "evidence sets:", evidenceSets
 
-        if debug: print "mnCards:", mnCards
-    
-        # Variable cliques
-        numCliques = int(inFile.readline().strip())
-        mnCliques = []
-        for i in range(numCliques):
-            cliqueAr = inFile.readline().strip().split()
-            
-            cliqueList = []
-            for j in range(1, len(cliqueAr)):
-                cliqueList.append(int(cliqueAr[j]))
-            mnCliques.append(cliqueList)
-        
-        if debug: print "mnCliques:", mnCliques, "\n"
-    else:
-        raise Exception("Error: Markov network input file format needed")
+    if debug:
+        for i in range(len(mnFactors)):
+            mnFactors[i].printF()
 
 def solveLoopyBP():
     """
     Solve loopy belief propagation
     """
     createMessages()
-    
-    loop = 0
-    done = False
-    while loop < 50 and not done:
-        # Save current F to V and V to F lists
-        sFtoV, sVtoF = [], []
-        for i in range(len(fToV)):
-            for j in range(len(fToV[i].val)):
-                sFtoV.append(fToV[i].val[j])
-            for j in range(len(vToF[i].val)):
-                sVtoF.append(vToF[i].val[j])
-        
-        if debug: 
-            print sFtoV
-            print sVtoF
-        
-        # Update messages in both directions
-        updateFtoVMessages()
-        updateVtoFMessages()
-       
-        # Compare differences with last marginals
-        diff = 0.0
-        index = 0
-        for i in range(len(fToV)):
-            for j in range(len(fToV[i].val)):
-                diff += math.fabs(fToV[i].val[j] - sFtoV[index])
-                index +=1
-        index = 0
-        for i in range(len(vToF)):
-            for j in range(len(vToF[i].val)):
-                diff += math.fabs(vToF[i].val[j] - sVtoF[index])
-                index += 1
-        
-        if debug: print "diff:", diff
-            
-        # If differences fall below 0.00001 stop
-        if diff < 0.00001:
-            done = True
-            
-        loop += 1
-    
-    if debug: print "Loops: ", loop, "\n"
-    
-    printMarginals()
 
-def sumOutVariable(factor, variable):
-    """
-    Sum out a variable from a factor
-    """
-    newVars = [x for x in factor.variables if x != variable]
-    varIndex = factor.variables.index(variable)
-    newF = Factor(newVars, mnCards)
-    
-    if debug: newF.printF()
-    
-    usedVar = [False for x in range(factor.size)]
-    
-    for i in range(newF.size):
-        newF.phi.append(0)
-        
-        start = 0
-        for k in range(factor.size):
-            if usedVar[k] == False:
-                start = k
-                break
-        
-        for j in range(factor.card[varIndex]):
-            key = start + factor.stride[varIndex] * j
-            newF.phi[i] += factor.phi[key]
-            usedVar[key] = True
-
-        if debug: print "phi: ", i, " ", newF.phi[i]
-
-    return newF
-    
-def updateFtoVMessages():
-    """
-    Update factor to variable messages
-    """
-    global fToV
+    # The deadline counts from the start of message passing
+    deadline = None
+    if timeLimit is not None:
+        deadline = time.time() + timeLimit
+
+    if schedule == "residual":
+        # Allow as many single message updates as the flooding iterations would make
+        loop, converged = fg.runResidual(tolerance, maxIterations * fg.nEdges, damping, deadline)
+    elif procs > 1:
+        # Each worker process updates the messages of one region of the graph
+        varPart, factPart = partitionGraph(mnVars, mnCliques, procs)
+        loop, converged = runPartitioned(fg, varPart, factPart, procs, tolerance, maxIterations, damping, deadline)
+    else:
+        loop, converged = fg.runFlooding(tolerance, maxIterations, damping, deadline, threshold)
     
-    if debug: print "## Updating Factor to Variable Message"
+    if debug: 
+        fg.printM()
+        print "Loops: ", loop, "\n"
     
-    for i in range(len(fToV)):
-        if debug: 
-            fToV[i].printM()
-
-        factor = mnFactors[fToV[i].fact]
-        
-        msgs = dictVtoF[str(fToV[i].fact)]
-        if debug:
-            print "msgs: ", msgs
-        
-        factor = multiplyFactorAndMessages(factor, msgs, fToV[i].var)
-
-        factorVarLen = len(factor.variables)        
-        if factorVarLen > 1:
-            while factorVarLen > 1:
-                for j in range(factorVarLen):
-                    if factor.variables[j] != fToV[i].var:
-                        factor = sumOutVariable(factor, factor.variables[j])
-                        factorVarLen = len(factor.variables)
-                        break
-        factor.renormalize()
-        if debug:
-            print ""
-            print "After Factor Normalization"
-            factor.printF()
-            print "var: ", fToV[i].var, "fact: ", fToV[i].fact
-        
-        fToV[i].val = factor.phi[:]
-        fToV[i].renormalize()
-        
-        if debug:
-            print "#Message after normalization"
-            fToV[i].printM()
-    if debug: print ""
+    beliefs = fg.beliefs()
+    if evidenceSets is None:
+        printMarginals(beliefs)
+    else:
+        # One block of marginals per evidence set
+        for r in range(len(evidenceSets)):
+            printMarginals([b[r] for b in beliefs])
+
+    # Beliefs are printed either way, but they are only a fixed point when converged
+    if showStats:
+        if evidenceSets is not None:
+            loop, converged = " ".join(map(str, loop)), " ".join(map(str, converged))
+        if procs > 1:
+            print "cut edges:", cutEdges(fg, varPart, factPart)
+        if threshold is not None:
+            print "skipped updates:", fg.skipped
+        print "updates:" if schedule == "residual" else "iterations:", loop
+        print "converged:", converged
 
-def updateVtoFMessages():
-    """
-    Update variable to factor messages
-    """
-    global vToF
-    for i in range(len(vToF)):
-        msgs = dictFtoV[str(vToF[i].var)]
-        msgToMult = []
-        for j in range(len(msgs)):
-            if vToF[msgs[j]].fact != vToF[i].fact:
-                msgToMult.append(vToF[msgs[j]])
-        
-        if len(msgToMult) > 0:
-            size = len(msgToMult)
-            card = len(msgToMult[0].val)
-            
-            for j in range(card):
-                tot = 1.0
-            
-                for k in range(size):
-                    tot *= msgToMult[k].val[j]
-                vToF[i].val[j] = tot
-        
-    for i in range(len(vToF)):
-        vToF[i].renormalize()
-    
 if __name__ == "__main__":
     """
     The main function called when ve.py is run from the command line
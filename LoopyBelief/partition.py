@@ -0,0 +1,171 @@
+"""
+Partitioned loopy belief propagation over several worker processes.
+
+The variables are split into regions of about equal size by cutting a breadth first ordering
+of the interaction graph into contiguous pieces, and every factor goes to the region holding
+most of its variables. Each worker computes and normalizes only the messages out of its own
+factors and variables, in private scratch space, and copies them into message buffers held
+in shared memory. The messages along cut edges written by one worker are read by its
+neighbors after the next synchronization, so every iteration is the same flooding update a
+single process would make.
+
+Author: Jordan Weiler
+Date:   October 18, 2026
+"""
+
+from graph import interactionGraph
+from factorgraph import normalizeSegments
+from collections import deque
+import numpy as np
+import multiprocessing, time
+
+def partitionGraph(nVars, cliques, parts):
+    """
+    Assign every variable and every clique to one of parts regions
+
+    Returns the region of each variable and of each clique.
+    """
+    graph = interactionGraph(nVars, cliques)
+    order, seen = [], [False] * nVars
+    for start in range(nVars):
+        if seen[start]:
+            continue
+        seen[start] = True
+        queue = deque([start])
+        while len(queue) > 0:
+            v = queue.popleft()
+            order.append(v)
+            for u in sorted(graph[v]):
+                if not seen[u]:
+                    seen[u] = True
+                    queue.append(u)
+
+    varPart = np.zeros(nVars, dtype=np.int64)
+    for k in range(nVars):
+        varPart[order[k]] = k * parts // max(nVars, 1)
+
+    # Ties go to the lowest region
+    factPart = np.zeros(len(cliques), dtype=np.int64)
+    for i in range(len(cliques)):
+        if len(cliques[i]) > 0:
+            factPart[i] = np.bincount(varPart[list(cliques[i])], minlength=parts).argmax()
+    return varPart, factPart
+
+def cutEdges(fg, varPart, factPart):
+    """
+    Count the edges whose factor and variable are in different regions
+    """
+    return int((varPart[fg.edgeVar] != factPart[fg.edgeFact]).sum())
+
+def sharedArray(values):
+    """
+    Copy an array into shared memory that forked worker processes write to in place
+    """
+    shared = np.frombuffer(multiprocessing.RawArray("d", values.size), dtype=np.float64)
+    shared[:] = values
+    return shared
+
+def regionEntries(fg, edges):
+    """
+    List the message entries of the given edges, and where each edge's message starts in that list
+    """
+    cards = fg.edgeCard[edges]
+    starts = np.zeros(len(edges), dtype=np.int64)
+    starts[1:] = np.cumsum(cards)[:-1]
+    entries = np.repeat(fg.offsets[edges] - starts, cards) + np.arange(cards.sum())
+    return entries, starts
+
+def partitionWorker(fg, part, varPart, factPart, damping, conn):
+    """
+    Compute the messages out of one region's factors and variables whenever asked to
+    """
+    ownFactors = np.flatnonzero(factPart == part)
+    fg.compileGroups(ownFactors)
+    fEdges = np.flatnonzero(factPart[fg.edgeFact] == part)
+    vEdges = np.flatnonzero(varPart[fg.edgeVar] == part)
+    fEntries, fStarts = regionEntries(fg, fEdges)
+    vEntries, vStarts = regionEntries(fg, vEdges)
+    fg.compileStates(vEntries)
+    scratch = np.ones(fg.offsets[-1])
+
+    while True:
+        command = conn.recv()
+        if command == "ftov":
+            for g in range(len(fg.groupTables)):
+                if fg.cavity:
+                    fg.computeFtoVMessagesGroupCavity(g, fg.vToF, scratch)
+                else:
+                    fg.computeFtoVMessagesGroup(g, fg.vToF, scratch)
+            if len(fEdges) > 0:
+                messages = scratch[fEntries]
+                normalizeSegments(messages, fStarts, fg.edgeCard[fEdges])
+                fg.fToVNew[fEntries] = (1.0 - damping) * messages + damping * fg.fToV[fEntries]
+            conn.send(None)
+        elif command == "vtof":
+            if fg.cavity:
+                fg.computeVtoFMessagesCavity(fg.fToVNew, scratch)
+            else:
+                for e in vEdges:
+                    fg.computeVtoFMessage(e, fg.fToVNew, fg.message(scratch, e))
+            if len(vEdges) > 0:
+                messages = scratch[vEntries]
+                normalizeSegments(messages, vStarts, fg.edgeCard[vEdges])
+                fg.vToFNew[vEntries] = messages
+
+            # Residual of the messages this region wrote
+            diff = 0.0
+            if len(fEntries) > 0:
+                diff = np.abs(fg.fToVNew[fEntries] - fg.fToV[fEntries]).max()
+            if len(vEntries) > 0:
+                diff = max(diff, np.abs(fg.vToFNew[vEntries] - fg.vToF[vEntries]).max())
+            conn.send(diff)
+        elif command == "swap":
+            fg.swap()
+        else:
+            break
+    conn.close()
+
+def runPartitioned(fg, varPart, factPart, parts, tolerance=0.00001, maxIterations=50, damping=0.0, deadline=None):
+    """
+    Run flooding with every region in its own worker process
+
+    Returns the number of iterations and whether the run converged, like runFlooding.
+    """
+    if fg.batch is not None:
+        raise Exception("Error: partitioned message passing does not support batched evidence")
+
+    fg.fToV, fg.fToVNew = sharedArray(fg.fToV), sharedArray(fg.fToVNew)
+    fg.vToF, fg.vToFNew = sharedArray(fg.vToF), sharedArray(fg.vToFNew)
+
+    conns, workers = [], []
+    for part in range(parts):
+        parent, child = multiprocessing.Pipe()
+        worker = multiprocessing.Process(target=partitionWorker, args=(fg, part, varPart, factPart, damping, child))
+        worker.daemon = True
+        worker.start()
+        conns.append(parent)
+        workers.append(worker)
+
+    # Every phase ends when all workers reply, so no worker reads a buffer being written
+    loop, converged = 0, False
+    while loop < maxIterations and not converged:
+        if deadline is not None and time.time() >= deadline:
+            break
+        for conn in conns:
+            conn.send("ftov")
+        for conn in conns:
+            conn.recv()
+        for conn in conns:
+            conn.send("vtof")
+        diff = max([conn.recv() for conn in conns])
+        for conn in conns:
+            conn.send("swap")
+        fg.swap()
+        converged = diff < tolerance
+        loop += 1
+
+    for conn in conns:
+        conn.send("stop")
+    for worker in workers:
+        worker.join()
+    return loop, converged
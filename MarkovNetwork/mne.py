@@ -3,16 +3,26 @@ Markov Network Evaluator
 
 This program reads in a discrete Markove network file and prints out the partition function for the network
 
+The joint assignments of each connected component are enumerated in fixed-size blocks, so
+the full joint table is never held in memory. The last variables of a component make up one
+vectorized block of assignments, decoded once from precomputed strides. The other variables
+follow a reflected Gray code, so only one of them changes between consecutive blocks, and only
+the cached log values of the factors touching it are looked up again. The enumeration can be
+split over a pool of worker processes by fixing the values of the first variables.
+
 Author: Jordan Weiler
 Date:   May 3, 2013
 
 ex: python mne.py file.uai
 """
 
-from factor import Factor
-import sys, math
+import sys, os, math, multiprocessing
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from uai import readNetwork
+from graph import groupCliques
+import numpy as np
 
-global inFile, outFile, debug
+global inFile, outFile, debug, blockSize
 
 def closeFiles():
     """
@@ -21,63 +31,17 @@ def closeFiles():
     inFile.close()
     outFile.close()
 
-def factorProduct(f1, f2, mnCards):
-    """
-    Multiply two factors by finding same variable assignments and multiplying their phi together.
-    """
-    
-    # Get the unique variables across both factors 
-    uniqueVars = f2.variables[:]
-    for i in range(len(f1.variables)):
-        if f1.variables[i] not in uniqueVars:
-            uniqueVars.insert(0, f1.variables[i])
-
-    # Create the new product factor 
-    factor = Factor(uniqueVars)
-    for i in range(len(factor.variables)):
-        factor.setCard(i, mnCards[factor.variables[i]])
-    factor.calculateStrides()
-
-    j, k = 0, 0
-    psi = []
-    assignment = [0 for i in range(len(factor.variables))]
-    factorSize = 1
-
-    # Size of new factor will be product of each variable's cardinality 
-    for i in range(len(factor.card)):
-        factorSize *= factor.card[i]
-
-    for i in range(factorSize):
-        if debug: print "multiplying", j, k, f1.phi[j], f2.phi[k]
-        psi.append(f1.phi[j] * f2.phi[k])
-        
-        # Loop from last to first since values are 000, 001, 010, 011 instead of 000, 100, 010, 110 
-        for v in range(len(factor.variables)-1,-1,-1):
-            curVariable = factor.variables[v]
-            assignment[v] += 1
-            if assignment[v] == factor.card[v]:
-                assignment[v] = 0
-                if curVariable in f1.variables:
-                    j = j - (factor.card[v] - 1) * f1.stride[f1.variables.index(curVariable)]
-                if curVariable in f2.variables:
-                    k = k - (factor.card[v] - 1) * f2.stride[f2.variables.index(curVariable)]
-            else:
-                if curVariable in f1.variables:
-                    j = j + f1.stride[f1.variables.index(curVariable)]
-                if curVariable in f2.variables:
-                    k = k + f2.stride[f2.variables.index(curVariable)]
-                break
-                
-    factor.phi = psi[:]
-
-    return factor
-    
 def parseInputArguments():
     """
     Parses the input arguments
     """
-    global inFile, outFile, debug
+    global inFile, outFile, evidFileName, debug, useCache, procs, logSpace, blockSize
     debug = False
+    blockSize = 65536
+    logSpace = False
+    procs = 1
+    useCache = False
+    evidFileName = None
 
     args = sys.argv[1:]
 
@@ -91,106 +55,162 @@ def parseInputArguments():
         for i in range(1, len(args)):
             if args[i].lower() == "debug":
                 debug = True
+            elif args[i].lower() == "cache":
+                useCache = True
+            elif args[i].lower() == "log":
+                logSpace = True
+            elif args[i].lower().startswith("evid="):
+                evidFileName = args[i].split("=", 1)[1]
+            elif args[i].lower().startswith("procs="):
+                procs = int(args[i].split("=", 1)[1])
+            elif args[i].lower().startswith("block="):
+                blockSize = int(args[i].split("=", 1)[1])
+                if blockSize < 1:
+                    raise Exception("Error: block size must be at least 1")
             else:
                 raise Exception("Error: " + args[i] + " argument not recognized")
 
     # Open output file
     outFile = open(args[0] + ".pr", "w")
 
-def readFunctionTables(mnCards, mnCliques):
-    """
-    Reads function tables defined in the input file
-    """
-    mnFactors = []
-    factorIndex, factorNum = 0, 0
-
-    fClass = Factor(mnCliques[factorIndex])
-    for i in range(len(fClass.variables)):
-        fClass.setCard(i, mnCards[fClass.variables[i]])
-    fClass.calculateStrides()
-    
-    factor = []
-    done = False
-    while not done:
-        inputRow = inFile.readline().strip()
-        if inputRow == "":
-            continue
-        else:
-            if " " in inputRow:
-                splitRow = inputRow.split()
-                if factorNum == 0:
-                    factorNum = int(splitRow[0])
-                    for i in range(1, len(splitRow)):
-                        factor.append(float(splitRow[i]))
-                else:
-                    for i in range(len(splitRow)):
-                        factor.append(float(splitRow[i]))
-                        
-                if factorNum == len(factor):
-                    factorNum = 0
-                    fClass.phi = factor
-                    mnFactors.append(fClass)
-                    factor = []
-                    factorIndex += 1
-                    if factorIndex < len(mnCliques):
-                        fClass = Factor(mnCliques[factorIndex])
-                        for i in range(len(fClass.variables)):
-                            fClass.setCard(i, mnCards[fClass.variables[i]])
-                        fClass.calculateStrides()
-            else:
-                factorNum = int(inputRow)
-                
-        if len(mnFactors) >= len(mnCliques):
-            # We have read in all the cliques so break out of while loop 
-            done = True
-    
-    return mnFactors
-
 def readInputFile():
     """
     Reads the preamble and function tables from the input file
     """
-    mnCards, mnCliques = readPreamble()
-	
-    mnFactors = readFunctionTables(mnCards, mnCliques)
-    
-    return mnCards, mnFactors
-
-def readPreamble():
-    """
-    Read preamble defined in the input file
-    """
-    mnCards, mnCliques = None, None
-    
-    inputRow = inFile.readline().strip()
-    if inputRow.lower() == "markov":
-        # Number of variables 
-        mnVars = int(inFile.readline().strip())
-        if debug: print "mnVars:", mnVars
-        
-        # Variable cardinality 
-        mnCards = []
-        cardinalityAr = inFile.readline().strip().split()
-        for c in cardinalityAr:
-            mnCards.append(int(c))
-        if debug: print "mnCards:", mnCards
-    
-        # Variable cliques 
-        numCliques = int(inFile.readline().strip())
-        mnCliques = []
-        for i in range(numCliques):
-            cliqueAr = inFile.readline().strip().split()
-            
-            cliqueList = []
-            for j in range(1, len(cliqueAr)):
-                cliqueList.append(int(cliqueAr[j]))
-            mnCliques.append(cliqueList)
-        if debug: print "mnCliques:", mnCliques, "\n"
-
-        return mnCards, mnCliques
+    model, evidence, factors = readNetwork(inFile, useCache, evidFileName, debug)
+    return model.cards, factors
 
-    else:
-        raise Exception("Error: Markov network input file needed")
+def grayCode(radices):
+    """
+    Generate the steps of a reflected mixed-radix Gray code starting from all zeros
+
+    Each step is the digit that changes and whether it goes up or down by one. Digit 0
+    changes fastest. Every radix must be at least 2.
+    """
+    n = len(radices)
+    digits, direction, focus = [0] * n, [1] * n, range(n + 1)
+    while True:
+        j = focus[0]
+        focus[0] = 0
+        if j == n:
+            return
+        digits[j] += direction[j]
+        yield j, direction[j]
+        if digits[j] == 0 or digits[j] == radices[j] - 1:
+            direction[j] = -direction[j]
+            focus[j] = focus[j+1]
+            focus[j+1] = j + 1
+
+def splitLogs(logs):
+    """
+    Split log values into their finite parts and an indicator of the zeros they stand for
+    """
+    zero = np.isneginf(logs)
+    return np.where(zero, 0.0, logs), zero.astype(np.int64)
+
+def productSum(task):
+    """
+    Add up the product of a component's factors over every joint assignment that agrees with
+    the fixed values, and return the log of the sum
+    """
+    mnFactors, fixed = task
+    if debug:
+        for f in mnFactors:
+            f.printF()
+
+    cards = dict()
+    for f in mnFactors:
+        cards.update(zip(f.variables, f.card))
+    variables = [v for v in sorted(cards) if v not in fixed]
+
+    # The last variables that fit in one block are enumerated together with vectorized strides
+    inner, size = [], 1
+    for v in reversed(variables):
+        if size * cards[v] > blockSize:
+            break
+        inner.insert(0, v)
+        size *= cards[v]
+    index = np.arange(size, dtype=np.int64)
+    innerAssign, stride = dict(), 1
+    for v in reversed(inner):
+        innerAssign[v] = (index // stride) % cards[v]
+        stride *= cards[v]
+    outer = [v for v in variables if v not in innerAssign and cards[v] > 1]
+
+    # Every factor's table entries for the block, split into a changing base and block offsets
+    value = dict((v, 0) for v in variables)
+    value.update(fixed)
+    with np.errstate(divide="ignore"):
+        tables = [np.log(f.phi) for f in mnFactors]
+    base, offsets, finite, zeros = [], [], [], []
+    varFactors = dict((v, []) for v in outer)
+    for i in range(len(mnFactors)):
+        f = mnFactors[i]
+        b, o = 0, np.zeros(size, dtype=np.int64)
+        for v, s in zip(f.variables, f.stride):
+            if v in innerAssign:
+                o += innerAssign[v] * s
+            else:
+                b += value[v] * s
+                if v in varFactors:
+                    varFactors[v].append((i, s))
+        base.append(b)
+        offsets.append(o)
+        fin, zero = splitLogs(tables[i][b + o])
+        finite.append(fin)
+        zeros.append(zero)
+
+    # Log of the block's products kept as a finite sum and a count of zero factors
+    total = np.sum(finite, axis=0) if len(finite) > 0 else np.zeros(size)
+    zeroCount = np.sum(zeros, axis=0) if len(zeros) > 0 else np.zeros(size, dtype=np.int64)
+
+    # The running sum is kept relative to shift, the largest log value seen so far
+    acc, shift = 0.0, -float("inf")
+    steps = grayCode([cards[v] for v in outer])
+    while True:
+        values = np.where(zeroCount > 0, -float("inf"), total)
+        top = values.max()
+        if top > shift:
+            acc *= math.exp(shift - top)
+            shift = top
+        if shift > -float("inf"):
+            acc += np.exp(values - shift).sum()
+
+        step = next(steps, None)
+        if step is None:
+            break
+
+        # Only the factors touching the changed variable move to new table entries
+        j, delta = step
+        for i, s in varFactors[outer[j]]:
+            base[i] += delta * s
+            fin, zero = splitLogs(tables[i][base[i] + offsets[i]])
+            total += fin - finite[i]
+            zeroCount += zero - zeros[i]
+            finite[i], zeros[i] = fin, zero
+
+    if acc <= 0:
+        return -float("inf")
+    return float(math.log(acc) + shift + sum(f.logScale for f in mnFactors))
+
+def splitAssignments(variables, cards, parts):
+    """
+    Fix the first variables to every combination of their values, making at least parts pieces
+    when there are enough variables, and return the fixed values of each piece
+    """
+    fixed, count = [], 1
+    while count < parts and len(fixed) < len(variables) - 1:
+        fixed.append(variables[len(fixed)])
+        count *= cards[fixed[-1]]
+
+    pieces = []
+    for k in range(count):
+        assignment = dict()
+        for v in reversed(fixed):
+            assignment[v] = k % cards[v]
+            k //= cards[v]
+        pieces.append(assignment)
+    return pieces
 
 def solvePR(mnCards, mnFactors):
     """
@@ -199,30 +219,39 @@ def solvePR(mnCards, mnFactors):
     if debug: print "solving PR"
     outFile.write("PR\n")
 
-    if debug:
-        mnFactors[0].printF()
-        mnFactors[1].printF()
-
-    if len(mnFactors) > 1:
-        # Get the first product of factors
-        newF = factorProduct(mnFactors[0], mnFactors[1], mnCards)
-        if debug: newF.printF()
-
-        for i in range(1, len(mnFactors)-1):
-            # Combine all other factors into total product
-            newF = factorProduct(newF, mnFactors[i+1], mnCards)
-            
-            if debug:
-                print "newF"
-                newF.printF()
+    # Connected components are independent, so each one is enumerated on its own, and with
+    # several processes each component is also split by fixing its first variables
+    groups, constants = groupCliques(len(mnCards), [f.variables for f in mnFactors])
+    tasks, owners = [], []
+    for c in range(len(groups)):
+        variables, cliques = groups[c]
+        for fixed in splitAssignments(variables, mnCards, 4 * procs if procs > 1 else 1):
+            tasks.append(([mnFactors[i] for i in cliques], fixed))
+            owners.append(c)
+    if debug: print "components:", len(groups), "tasks:", len(tasks)
+
+    if procs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(procs)
+        parts = pool.map(productSum, tasks)
+        pool.close()
+        pool.join()
     else:
-        newF = mnFactors[0]
-
-    # Sum all values in the factor 
-    total = 0
-    for i in range(len(newF.phi)):
-        total += newF.phi[i]
-    Z = str(total)
+        parts = [productSum(task) for task in tasks]
+
+    # The pieces of a component add up, in log space
+    results = [-float("inf")] * len(groups)
+    for c, part in zip(owners, parts):
+        results[c] = float(np.logaddexp(results[c], part))
+    results += [mnFactors[i].logTotal() for i in constants]
+
+    # Combine the components as a sum of logs so the product cannot overflow along the way
+    logZ = sum(results)
+    if logSpace:
+        Z = str(logZ)
+    elif logZ > math.log(sys.float_info.max):
+        Z = str(float("inf"))
+    else:
+        Z = str(math.exp(logZ))
 
     print Z
     outFile.write(Z)
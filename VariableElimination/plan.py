@@ -0,0 +1,115 @@
+"""
+Elimination plan for variable elimination.
+
+A plan symbolically simulates variable elimination for an ordering without touching any
+tables. It records the scope and table size of every intermediate factor, the number of
+multiply-adds and the peak memory held by live tables, so a run can be checked against a
+memory budget before it starts. Plans are saved as JSON and can be reused for any network
+with the same structure.
+
+Author: Jordan Weiler
+Date:   October 18, 2026
+"""
+
+from factor import contractionOrder, tableSize
+import hashlib, json
+
+BYTES_PER_ENTRY = 8
+
+class EliminationPlan:
+    def __init__(self, structure, heuristic, order, steps):
+        self.structure = structure  #key of the cardinalities and cliques the plan was made for
+        self.heuristic = heuristic  #heuristic that produced the ordering
+        self.order = order          #elimination ordering
+        self.steps = steps          #one entry per eliminated variable with a non-empty bucket
+        self.totalFlops = sum(s["flops"] for s in steps)
+        self.peakMemory = max([s["memory"] for s in steps] + [0])
+        self.maxSize = max([s["productSize"] for s in steps] + [1])
+
+    def printP(self):
+        """
+        Print the plan details
+        """
+        print "Plan"
+        print "heuristic:", self.heuristic
+        print "order:", self.order
+        for s in self.steps:
+            print "eliminate", s["variable"], "product size:", s["productSize"], "scope:", s["scope"], "size:", s["size"], "flops:", s["flops"], "memory:", s["memory"]
+        print "total flops:", self.totalFlops
+        print "largest table:", self.maxSize
+        print "peak memory:", self.peakMemory
+        print ""
+
+    def toDict(self):
+        """
+        Convert the plan to a dictionary that can be written as JSON
+        """
+        return {"structure": self.structure, "heuristic": self.heuristic, "order": self.order, "steps": self.steps}
+
+def structureKey(cards, cliques):
+    """
+    Hash the cardinalities and cliques of a network so a plan is only reused on the same structure
+    """
+    return hashlib.sha1(json.dumps([list(cards), [list(c) for c in cliques]])).hexdigest()
+
+def makePlan(cards, cliques, order, heuristic):
+    """
+    Simulate variable elimination along an ordering and record every intermediate factor
+    """
+    # Scope and size of every live table, starting with the network's factors
+    scopes = [set(c) for c in cliques]
+    sizes = [tableSize(cards, c) for c in cliques]
+    live = set(range(len(scopes)))
+    liveSize = sum(sizes)
+
+    steps = []
+    for v in order:
+        bucket = [i for i in live if v in scopes[i]]
+        if len(bucket) == 0:
+            continue
+
+        # Follow the same pairwise contraction the bucket will be eliminated with
+        tables = [scopes[i] for i in bucket]
+        tableSizes = [sizes[i] for i in bucket]
+        flops, size, peak, current = 0, 0, liveSize, liveSize
+        for a, b, keep in contractionOrder(tables, cards, [v]):
+            flops += tableSize(cards, tables[a] | tables[b])
+            tables.append(set(keep))
+            tableSizes.append(tableSize(cards, keep))
+            size = max(size, tableSizes[-1])
+            peak = max(peak, current + tableSizes[-1])
+            current += tableSizes[-1] - tableSizes[a] - tableSizes[b]
+
+        newScope = tables[-1] - set([v])
+        newSize = tableSize(cards, newScope)
+        if v in tables[-1]:
+            flops += tableSizes[-1]
+            peak = max(peak, current + newSize)
+
+        steps.append({"variable": v, "scope": sorted(newScope), "size": newSize, "productSize": max(size, newSize),
+                      "flops": flops, "memory": peak * BYTES_PER_ENTRY})
+
+        for i in bucket:
+            live.discard(i)
+            liveSize -= sizes[i]
+        scopes.append(newScope)
+        sizes.append(newSize)
+        live.add(len(scopes) - 1)
+        liveSize += newSize
+
+    return EliminationPlan(structureKey(cards, cliques), heuristic, list(order), steps)
+
+def savePlan(plan, fileName):
+    """
+    Write a plan to a JSON file
+    """
+    with open(fileName, "w") as f:
+        json.dump(plan.toDict(), f)
+
+def loadPlan(fileName):
+    """
+    Read a plan from a JSON file
+    """
+    with open(fileName, "r") as f:
+        d = json.load(f)
+    return EliminationPlan(d["structure"], d["heuristic"], [int(v) for v in d["order"]], d["steps"])
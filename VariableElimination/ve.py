@@ -3,18 +3,32 @@ Markov Network Evaluator Using Variable Elimination
 
 This command line program reads in a Markov network file and prints out the partition function for the network (computed with variable elimination). The variable elimination algorithm uses the min-neighbors heuristic for variable ordering by default.
 
+With an i-bound, ve.py computes bounds on the partition function instead. Buckets whose scope has more than i variables are split into mini-buckets of at most i variables. One mini-bucket is summed over the bucket's variable and the others are maximized, or minimized, over it, giving an upper, or lower, bound in time and memory exponential only in i.
+
+When no ordering fits the memory or width budget, ve.py can condition on a cutset instead. Variables from the largest intermediate factor are conditioned on until the rest of the network fits, then the reduced network is eliminated once for every assignment of the cutset and the results are added up.
+
+With a RAM threshold, intermediate factors larger than the threshold are kept in memory-mapped files on scratch disk, and their products and sums are computed one block of their slowest variables at a time.
+
 Author: Jordan Weiler
 Date:   May 17, 2013
 
 ex. python ve.py file.uai
 """
 
-from factor import Factor
-import sys, math
+import sys, os, math, multiprocessing, resource
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from factor import factorProductList, contractFactors, reduceFactors, rescaled, maxOutVariables, minOutVariables, useScratch
+from uai import readNetwork
+from graph import HEURISTICS, findOrdering, orderingStats, groupCliques, interactionGraph
+from plan import makePlan, structureKey, savePlan, loadPlan
+import numpy as np
 
 global inFile
 global mnVars, mnCards, mnCliques, mnFactors
-global debug
+global heuristic, restarts, seed
+global planFile, memoryBudget, widthBudget, useCutset, iBound, procs
+global ramThreshold, scratchDir
+global debug, showStats, showPlan, logSpace
 
 def closeFiles():
     """
@@ -22,55 +36,30 @@ def closeFiles():
     """
     inFile.close()
 
-def factorProduct(f1, f2):
-    """
-    Multiplies two factors by finding same variable assignments and multiplying their phi together
-    """
-    
-    # Get the unique variables across both factors
-    uniqueVars = f2.variables[:]
-    for i in range(len(f1.variables)):
-        if f1.variables[i] not in uniqueVars:
-            uniqueVars.insert(0, f1.variables[i])
-
-    # Create the new product factor
-    factor = Factor(uniqueVars, mnCards)
-
-    j, k = 0, 0
-    psi = []
-    assignment = [0 for i in range(len(factor.variables))]
-    
-    for i in range(factor.size):
-        #if debug: print "multiplying", j, k, f1.phi[j], f2.phi[k]
-        psi.append(f1.phi[j] * f2.phi[k])
-        
-        # Loop from last to first since values are 000, 001, 010, 011 instead of 000, 100, 010, 110
-        for v in range(len(factor.variables)-1,-1,-1):
-            curVariable = factor.variables[v]
-            assignment[v] += 1
-            if assignment[v] == factor.card[v]:
-                assignment[v] = 0
-                if curVariable in f1.variables:
-                    j = j - (factor.card[v] - 1) * f1.stride[f1.variables.index(curVariable)]
-                if curVariable in f2.variables:
-                    k = k - (factor.card[v] - 1) * f2.stride[f2.variables.index(curVariable)]
-            else:
-                if curVariable in f1.variables:
-                    j = j + f1.stride[f1.variables.index(curVariable)]
-                if curVariable in f2.variables:
-                    k = k + f2.stride[f2.variables.index(curVariable)]
-                break
-                
-    factor.phi = psi[:]
-
-    return factor
-    
 def parseInputArguments():
     """
     Parse the input arguments
     """
-    global inFile, debug
+    global inFile, evidFileName, debug, useCache, showStats, showPlan, logSpace
+    global heuristic, restarts, seed, planFile, memoryBudget, widthBudget, useCutset, iBound, procs
+    global ramThreshold, scratchDir
     debug = False
+    useCache = False
+    evidFileName = None
+    showStats = False
+    showPlan = False
+    logSpace = False
+    planFile = None
+    memoryBudget = None
+    widthBudget = None
+    useCutset = False
+    iBound = None
+    procs = 1
+    ramThreshold = None
+    scratchDir = None
+    heuristic = "minneighbors"
+    restarts = 1
+    seed = 0
 
     args = sys.argv[1:]
 
@@ -83,207 +72,333 @@ def parseInputArguments():
         for i in range(1, len(args)):
             if args[i].lower() == "debug":
                 debug = True
+            elif args[i].lower() == "cache":
+                useCache = True
+            elif args[i].lower().startswith("evid="):
+                evidFileName = args[i].split("=", 1)[1]
+            elif args[i].lower() == "stats":
+                showStats = True
+            elif args[i].lower() == "plan":
+                showPlan = True
+            elif args[i].lower() == "log":
+                logSpace = True
+            elif args[i].lower().startswith("planfile="):
+                planFile = args[i].split("=", 1)[1]
+            elif args[i].lower().startswith("memory="):
+                # Memory budget is given in megabytes
+                memoryBudget = float(args[i].split("=", 1)[1]) * 1024 * 1024
+            elif args[i].lower().startswith("width="):
+                widthBudget = int(args[i].split("=", 1)[1])
+            elif args[i].lower() == "cutset":
+                useCutset = True
+            elif args[i].lower().startswith("ibound="):
+                iBound = int(args[i].split("=", 1)[1])
+                if iBound < 1:
+                    raise Exception("Error: i-bound must be at least 1")
+            elif args[i].lower().startswith("order="):
+                heuristic = args[i].split("=", 1)[1].lower()
+                if heuristic not in HEURISTICS:
+                    raise Exception("Error: ordering heuristic " + heuristic + " not recognized")
+            elif args[i].lower().startswith("restarts="):
+                restarts = int(args[i].split("=", 1)[1])
+            elif args[i].lower().startswith("seed="):
+                seed = int(args[i].split("=", 1)[1])
+            elif args[i].lower().startswith("procs="):
+                procs = int(args[i].split("=", 1)[1])
+            elif args[i].lower().startswith("ram="):
+                # RAM threshold is given in megabytes
+                ramThreshold = float(args[i].split("=", 1)[1]) * 1024 * 1024
+            elif args[i].lower().startswith("scratch="):
+                scratchDir = args[i].split("=", 1)[1]
             else:
                 raise Exception("Error: " + args[i] + " argument not recognized")
 
-def readFunctionTables():
+    if useCutset and iBound is not None:
+        raise Exception("Error: cutset cannot be combined with ibound")
+    if scratchDir is not None and ramThreshold is None:
+        raise Exception("Error: scratch requires ram")
+
+def budgetError(plan, cliques):
     """
-    Reads function tables defined in the input file
+    Describe how a plan goes over the memory or width budget, or return None if it fits
     """
-    global mnFactors
-    mnFactors = []
-    factorIndex, factorNum = 0, 0
-
-    fClass = Factor(mnCliques[factorIndex], mnCards)
-    
-    factor = []
-    done = False
-    while not done:
-        inputRow = inFile.readline().strip()
-        if inputRow == "":
-            continue
-        else:
-            if " " in inputRow:
-                splitRow = inputRow.split()
-                if factorNum == 0:
-                    factorNum = int(splitRow[0])
-                    for i in range(1, len(splitRow)):
-                        factor.append(float(splitRow[i]))
-                else:
-                    for i in range(len(splitRow)):
-                        factor.append(float(splitRow[i]))
-                        
-                if factorNum == len(factor):
-                    factorNum = 0
-                    fClass.phi = factor
-                    mnFactors.append(fClass)
-                    factor = []
-                    factorIndex += 1
-                    if factorIndex < len(mnCliques):
-                        fClass = Factor(mnCliques[factorIndex], mnCards)
-            else:
-                factorNum = int(inputRow)
-                
-        if len(mnFactors) >= len(mnCliques):
-            """ read in all the cliques so break out of while loop """
-            done = True
+    if memoryBudget is not None and plan.peakMemory > memoryBudget:
+        return "elimination needs " + str(plan.peakMemory) + " bytes which is over the memory budget of " + str(int(memoryBudget)) + " bytes"
+    if widthBudget is not None:
+        width, cliqueSize = orderingStats(mnVars, cliques, mnCards, plan.order)
+        if width > widthBudget:
+            return "elimination has induced width " + str(width) + " which is over the width budget of " + str(widthBudget)
+    return None
+
+def chooseCutset(plan):
+    """
+    Condition on variables until eliminating the rest of the network fits the budget
 
-def readInputFile():
+    Each round conditions on the variable with the most neighbors in the largest
+    intermediate factor of the current plan, then plans the reduced network again.
+    Returns the cutset, the reduced cliques and their plan.
     """
-    Read the preamble and function tables from the input file
+    cutset, cliques = [], mnCliques
+    while budgetError(plan, cliques) is not None:
+        step = max(plan.steps, key=lambda s: s["productSize"])
+        graph = interactionGraph(mnVars, cliques)
+        cutset.append(max([step["variable"]] + step["scope"], key=lambda u: (len(graph[u]), -u)))
+
+        cliques = [[u for u in c if u not in cutset] for c in mnCliques]
+        order = [u for u in findOrdering(mnVars, cliques, mnCards, heuristic, restarts, seed) if u not in cutset]
+        plan = makePlan(mnCards, cliques, order, heuristic)
+        if debug: print "cutset:", cutset, "peak memory:", plan.peakMemory
+
+    if showPlan: plan.printP()
+    return cutset, cliques, plan
+
+def peakRSS():
     """
-    readPreamble()
-    	
-    readFunctionTables()
+    Find the peak resident memory in megabytes of this process or any of its pool workers
+    """
+    # Linux reports ru_maxrss in kilobytes
+    usage = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return round(usage / 1024.0, 1)
 
-def readPreamble():
+def planElimination():
     """
-    Read preamble defined in the input file
+    Choose an elimination ordering and check its plan against the memory and width budgets
     """
-    global mnVars, mnCards, mnCliques
-    
-    inputRow = inFile.readline().strip()
-    if inputRow.lower() == "markov":
-        """ number of variables """
-        mnVars = int(inFile.readline().strip())
-
-        if debug: print "mnVars:", mnVars
-        
-        """ variable cardinality """
-        mnCards = []
-        cardinalityAr = inFile.readline().strip().split()
-        for c in cardinalityAr:
-            mnCards.append(int(c))
-
-        if debug: print "mnCards:", mnCards
-    
-        """ variable cliques """
-        numCliques = int(inFile.readline().strip())
-        mnCliques = []
-        for i in range(numCliques):
-            cliqueAr = inFile.readline().strip().split()
-            
-            cliqueList = []
-            for j in range(1, len(cliqueAr)):
-                cliqueList.append(int(cliqueAr[j]))
-            mnCliques.append(cliqueList)
-
-        if debug: print "mnCliques:", mnCliques, "\n"
-    else:
-        raise Exception("Error: Markov network input file needed")
+    plan = None
+    if planFile is not None and os.path.exists(planFile):
+        plan = loadPlan(planFile)
+        if plan.structure != structureKey(mnCards, mnCliques):
+            if debug: print "plan file is for a different network structure"
+            plan = None
+
+    if plan is None:
+        order = findOrdering(mnVars, mnCliques, mnCards, heuristic, restarts, seed)
+        plan = makePlan(mnCards, mnCliques, order, heuristic)
+
+        if memoryBudget is not None and plan.peakMemory > memoryBudget:
+            # Switch to the heuristic whose ordering needs the least memory
+            original = plan
+            for h in HEURISTICS:
+                order = findOrdering(mnVars, mnCliques, mnCards, h, max(restarts, 10), seed)
+                other = makePlan(mnCards, mnCliques, order, h)
+                if other.peakMemory < plan.peakMemory:
+                    plan = other
+            if debug and plan is not original: print "switched to", plan.heuristic, "ordering"
+
+        if planFile is not None:
+            savePlan(plan, planFile)
+
+    if showPlan: plan.printP()
+
+    # Mini-buckets keep every table within the i-bound, so the budgets do not apply
+    error = budgetError(plan, mnCliques)
+    if error is not None and not useCutset and iBound is None:
+        raise Exception("Error: " + error)
+
+    return plan
 
-def factorProductList(factors):
+def readInputFile():
     """
-    Find the product of a list of factors
+    Read the preamble and function tables from the input file
     """
-    if debug: print "factor product list: ", len(factors)
+    global mnVars, mnCards, mnCliques, mnFactors
 
-    if len(factors) < 2:
-        return factors[0]
-    else:
-        newF = factors[0]
-        for i in range(1, len(factors)):
-            newF = factorProduct(newF, factors[i])
-        return newF
-    
-def sumOutVariable(factor, variable):
+    model, evidence, mnFactors = readNetwork(inFile, useCache, evidFileName, debug)
+    mnVars, mnCards = model.nVars, model.cards
+    mnCliques = [f.variables for f in mnFactors]
+
+def eliminateFactors(factors, order):
     """
-    Sum out a variable for variable elimination
+    Eliminate the variables in order from a list of factors and return the log partition function
     """
-    if debug: print "eliminating factor"
+    factors = list(factors)
+    if logSpace:
+        factors = [rescaled(f) for f in factors]
 
-    newVars = [x for x in factor.variables if x != variable]
+    for eliminateV in order:
+        if debug: print "eliminating : ", eliminateV
 
-    if debug: print "new vars: ", newVars
+        elimIndexSet = []
+        elimFactors = []
 
-    newF = Factor(newVars, mnCards)
+        for j in range(len(factors)-1, -1, -1):
+            if debug: print "j: ", factors[j].variables
+            if eliminateV in factors[j].variables:
+                if debug: print "adding : ", j
+                elimIndexSet.append(j)
+                elimFactors.append(factors[j])
+                factors.pop(j)
 
-    if len(newVars) > 0:
-        varIndex = factor.variables.index(variable)
-        if debug: 
-            print "var index: ", varIndex
-            newF.printF()
+        if debug: print "elim Set: ", elimIndexSet
 
-        usedVar = [False for x in range(factor.size)]
+        if len(elimFactors) == 0:
+            continue
 
-        if debug: 
-            print "used var: ", usedVar
-            print "stride: ", factor.stride[varIndex], ", card: ", factor.card[varIndex]
+        # Multiply the bucket and sum out the variable without forming the full product
+        newF = contractFactors(elimFactors, [eliminateV], logSpace)
 
-        psi = []
-        for i in range(newF.size):
-            psi.append(0)
-    
-            start = 0
-            for k in range(factor.size):
-                if usedVar[k] == False:
-                    start = k
-                    break
-    
-            for j in range(factor.card[varIndex]):
-                if debug: print "start: ", start, " stride: ", factor.stride[varIndex], " j: ", j
-                psi[i] += factor.phi[start + factor.stride[varIndex] * j]
-                usedVar[start + factor.stride[varIndex] * j] = True
+        if debug:
+            print "improvedF: "
+            newF.printF()
 
-            if debug: print "psi: ", i, " ", psi[i]
+        factors.append(newF)
 
-        newF.phi = psi[:]
+    # Only constant factors remain once every variable is eliminated
+    newF = factorProductList(factors)
 
-    return newF
-    
-def solvePR():
-    """
-    Solve the partition function
+    if debug:
+        print "Last factor:"
+        newF.printF()
+
+    # Sum all values in the factor
+    return newF.logTotal()
+
+def eliminateMiniBuckets(factors, order, collapse):
     """
-    if debug: print "solving PR"
+    Eliminate the variables in order with buckets split to the i-bound and return the log of
+    the resulting bound on the partition function
 
-    if len(mnFactors) > 1:
-        for i in range(mnVars - 1):
-            if debug: print "eliminating : ", i
+    collapse removes the bucket's variable from every mini-bucket but the first, either
+    maxOutVariables for an upper bound or minOutVariables for a lower bound.
+    """
+    factors = list(factors)
+    if logSpace:
+        factors = [rescaled(f) for f in factors]
+
+    for eliminateV in order:
+        bucket = [f for f in factors if eliminateV in f.variables]
+        factors = [f for f in factors if eliminateV not in f.variables]
+        if len(bucket) == 0:
+            continue
 
-            eliminateV = i
-            elimIndexSet = []
-            elimFactors = []
+        # Place the widest factors first, each into the first mini-bucket it fits in
+        miniBuckets, scopes = [], []
+        for f in sorted(bucket, key=lambda f: -len(f.variables)):
+            for k in range(len(miniBuckets)):
+                if len(scopes[k] | set(f.variables)) <= iBound:
+                    miniBuckets[k].append(f)
+                    scopes[k].update(f.variables)
+                    break
+            else:
+                miniBuckets.append([f])
+                scopes.append(set(f.variables))
+        if debug: print "eliminating :", eliminateV, "mini-buckets:", [sorted(s) for s in scopes]
 
-            for j in range(len(mnFactors)-1, -1, -1):
-                if debug: print "j: ", mnFactors[j].variables
-                if eliminateV in mnFactors[j].variables:
-                    if debug: print "adding : ", j
-                    elimIndexSet.append(j)
-                    elimFactors.append(mnFactors[j])
-                    mnFactors.pop(j)
-                    
-            if debug: print "elim Set: ", elimIndexSet
+        factors.append(contractFactors(miniBuckets[0], [eliminateV], logSpace))
+        for miniBucket in miniBuckets[1:]:
+            newF = collapse(factorProductList(miniBucket), [eliminateV])
+            if logSpace: newF.rescale()
+            factors.append(newF)
 
-            newF = factorProductList(elimFactors)
+    return factorProductList(factors).logTotal()
 
-            if debug:
-                print "newF: "
-                newF.printF()
-            
-            newF = sumOutVariable(newF, eliminateV)
+def solveBounds(task):
+    """
+    Bound the partition function of one connected component from above and below, used by the
+    process pool
+    """
+    factors, order = task
+    return eliminateMiniBuckets(factors, order, maxOutVariables), eliminateMiniBuckets(factors, order, minOutVariables)
 
-            if debug:
-                print "improvedF: "
-                newF.printF()
+def solveComponent(task):
+    """
+    Solve the partition function of one connected component, used by the process pool
+    """
+    factors, order = task
+    return eliminateFactors(factors, order)
 
-            mnFactors.append(newF)
+def solveCutset(task):
+    """
+    Add up the partition functions of the reduced network over a range of cutset assignments,
+    used by the process pool
+    """
+    cutset, order, start, end = task
+    results = []
+    while start < end:
+        # Decode the assignment with the last cutset variable changing fastest
+        evidence, k = dict(), start
+        for v in reversed(cutset):
+            evidence[v] = k % mnCards[v]
+            k //= mnCards[v]
+        results.append(eliminateFactors(reduceFactors(mnFactors, evidence), order))
+        start += 1
+    return float(np.logaddexp.reduce(results))
+
+def formatZ(logZ):
+    """
+    Format a log partition function for printing, as a log in log space
+    """
+    if logSpace:
+        return str(logZ)
+    elif logZ > math.log(sys.float_info.max):
+        return str(float("inf"))
+    return str(math.exp(logZ))
 
-        newF = mnFactors[0]
+def solvePR():
+    """
+    Solve the partition function
+    """
+    if debug: print "solving PR"
 
-        if debug: 
-            print "Last factor:"
-            newF.printF()
+    if ramThreshold is not None:
+        useScratch(ramThreshold, scratchDir)
+
+    plan = planElimination()
+    if debug: print "order: ", plan.order
+
+    cutset, cliques = [], mnCliques
+    if useCutset and budgetError(plan, mnCliques) is not None:
+        cutset, cliques, plan = chooseCutset(plan)
+
+    if len(cutset) > 0:
+        # Every cutset assignment is an independent elimination, split into chunks for the pool
+        count = 1
+        for v in cutset:
+            count *= mnCards[v]
+        chunks = min(count, 4 * procs)
+        tasks = [(cutset, plan.order, count * c // chunks, count * (c+1) // chunks) for c in range(chunks)]
+        if debug: print "cutset:", cutset, "assignments:", count
+        solve = solveCutset
+    else:
+        # Connected components are independent, so each one is eliminated on its own
+        groups, constants = groupCliques(mnVars, mnCliques)
+        tasks = []
+        for variables, indices in groups:
+            members = set(variables)
+            tasks.append(([mnFactors[i] for i in indices], [v for v in plan.order if v in members]))
+        if debug: print "components:", len(tasks)
+        solve = solveComponent if iBound is None else solveBounds
+
+    if procs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(procs)
+        results = pool.map(solve, tasks)
+        pool.close()
+        pool.join()
     else:
-        newF = mnFactors[0]
+        results = [solve(task) for task in tasks]
 
-    # Sum all values in the factor
-    total = 0
-    for i in range(len(newF.phi)):
-        total += newF.phi[i]
-    Z = str(total)
+    if len(cutset) > 0:
+        results = [float(np.logaddexp.reduce(results))]
+    else:
+        results += [mnFactors[i].logTotal() for i in constants]
 
-    print Z
+    # Combine the components as a sum of logs so the product cannot overflow along the way
+    if iBound is None:
+        print formatZ(sum(results))
+    else:
+        constant = sum(r for r in results if not isinstance(r, tuple))
+        print "upper bound:", formatZ(constant + sum(r[0] for r in results if isinstance(r, tuple)))
+        print "lower bound:", formatZ(constant + sum(r[1] for r in results if isinstance(r, tuple)))
+
+    if showStats:
+        width, cliqueSize = orderingStats(mnVars, cliques, mnCards, plan.order)
+        print "induced width:", width
+        print "max factor size:", plan.maxSize
+        if len(cutset) > 0:
+            print "cutset:", " ".join(map(str, cutset))
+    if showStats or ramThreshold is not None:
+        print "peak RSS:", peakRSS(), "MB"
     	
 if __name__ == "__main__":
     """